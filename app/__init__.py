@@ -1,39 +1,65 @@
 from flask import Flask
-from app.config import settings
-from app.database import engine, init_db, session_scope
-from sqlalchemy.orm import scoped_session, sessionmaker
 from flask_login import LoginManager
-from app.models import User
-
-app = Flask(__name__)
-app.config['SECRET_KEY'] = settings.SECRET_KEY
-app.config['SQLALCHEMY_DATABASE_URI'] = settings.DATABASE_URL
 
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = 'books.home'
 login_manager.login_message = 'Необходимо авторизоваться для доступа к этой странице'
 
 
 @login_manager.user_loader
 def load_user(user_id):
+    from app.auth.identity import UserIdentity, user_cache
+    from app.database import session_scope
+    from app.models import User
+
+    user_id = int(user_id)
+    identity = user_cache.get(user_id)
+    if identity is not None:
+        return identity
     with session_scope() as db_session:
-        # return db_session.query(User).get(int(user_id))
-        user = db_session.query(User).get(int(user_id))
-        if user:
-            db_session.expunge(user)
-        return user
+        user = (db_session.query(User.id, User.name, User.surname, User.email)
+                .filter_by(id=user_id)
+                .first())
+    if not user:
+        return None
+    identity = UserIdentity(**user._asdict())
+    user_cache.put(identity)
+    return identity
+
+
+def create_app():
+    """Создает приложение; модели, сервисы и блюпринты импортируются здесь, движок БД — при первом запросе к БД"""
+    from app.config import settings
+    from app import assets, database, filters, metrics, nplusone, reservations
+    from app.fragment_cache import CacheExtension
+
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = settings.SECRET_KEY
+    app.config['SQLALCHEMY_DATABASE_URI'] = settings.DATABASE_URL
+    app.jinja_env.add_extension(CacheExtension)
+    filters.init_app(app)
+    assets.init_app(app)
+    metrics.init_app(app)
+    nplusone.init_app(app)
+    database.init_app(app)
+    reservations.init_app(app)
+    login_manager.init_app(app)
+
+    from .auth.routes import auth_bp
+    from .books.routes import books_bp
+    from .cart.routes import cart_bp
+    from .orders.routes import orders_bp
 
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(books_bp)
+    app.register_blueprint(cart_bp)
+    app.register_blueprint(orders_bp)
 
-from .auth.routes import auth_bp
-from .books.routes import books_bp
-from .cart.routes import cart_bp
-from .orders.routes import orders_bp
+    from .commands import register_commands
 
-app.register_blueprint(auth_bp)
-app.register_blueprint(books_bp)
-app.register_blueprint(cart_bp)
-app.register_blueprint(orders_bp)
+    register_commands(app)
 
-app.db_session = scoped_session(sessionmaker(bind=engine))
+    from .services import AuthService, BookService, CartService, OrderService
 
+    metrics.instrument_services(AuthService, BookService, CartService, OrderService)
+    return app
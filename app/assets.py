@@ -0,0 +1,112 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+from pathlib import Path
+from flask import current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUILD_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+HASH_LENGTH = 12
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+# варианты в порядке предпочтения: (Content-Encoding, расширение файла)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _is_compressible(path):
+    mimetype, _ = mimetypes.guess_type(path.name)
+    return mimetype is not None and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def _write_compressed(path, data, use_brotli):
+    """Пишет .gz и .br рядом с файлом, если сжатие действительно уменьшает размер"""
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if use_brotli and brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    written = []
+    for suffix, compressed in variants:
+        if len(compressed) < len(data):
+            path.with_name(path.name + suffix).write_bytes(compressed)
+            written.append(suffix)
+    return written
+
+
+def build_assets(static_dir, use_brotli=True):
+    """Копирует статику в dist/ с хэшем содержимого в имени, сжимает текстовые файлы и пишет манифест"""
+    static_dir = Path(static_dir)
+    build_dir = static_dir / BUILD_DIR
+    manifest = {}
+    for source in sorted(static_dir.rglob('*')):
+        if not source.is_file() or build_dir in source.parents:
+            continue
+        data = source.read_bytes()
+        relative = source.relative_to(static_dir)
+        digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        target = build_dir / relative.with_name(f'{relative.stem}.{digest}{relative.suffix}')
+        if not target.exists():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(source, target)
+            if _is_compressible(source):
+                _write_compressed(target, data, use_brotli)
+        manifest[relative.as_posix()] = target.relative_to(static_dir).as_posix()
+
+    manifest_path = build_dir / MANIFEST_NAME
+    build_dir.mkdir(parents=True, exist_ok=True)
+    temp_path = manifest_path.with_suffix('.tmp')
+    temp_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True), encoding='utf-8')
+    os.replace(temp_path, manifest_path)
+    return manifest
+
+
+def load_manifest(static_dir):
+    """Манифест исходное имя -> имя с хэшем; пустой, если сборка не выполнялась"""
+    manifest_path = Path(static_dir) / BUILD_DIR / MANIFEST_NAME
+    if not manifest_path.exists():
+        return {}
+    return json.loads(manifest_path.read_text(encoding='utf-8'))
+
+
+def serve_static(filename):
+    """Отдает статику; собранные файлы — в сжатом варианте по Accept-Encoding и с вечным кэшированием"""
+    static_dir = current_app.static_folder
+    if filename not in current_app.extensions['assets']['fingerprinted']:
+        return current_app.send_static_file(filename)
+
+    mimetype, _ = mimetypes.guess_type(filename)
+    for encoding, suffix in ENCODINGS:
+        variant = filename + suffix
+        if request.accept_encodings.quality(encoding) > 0 and os.path.isfile(os.path.join(static_dir, variant)):
+            response = send_from_directory(static_dir, variant, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(static_dir, filename, max_age=IMMUTABLE_MAX_AGE)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def set_manifest(app, manifest):
+    """Подменяет манифест приложения, например после сборки в том же процессе"""
+    app.extensions['assets'] = {'manifest': manifest, 'fingerprinted': frozenset(manifest.values())}
+
+
+def init_app(app):
+    """Подставляет в url_for('static') имена с хэшем из манифеста и подключает отдачу сжатых вариантов"""
+    set_manifest(app, load_manifest(app.static_folder))
+
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = app.extensions['assets']['manifest'].get(values['filename'], values['filename'])
+
+    app.view_functions['static'] = serve_static
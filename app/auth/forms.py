@@ -1,7 +1,18 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import InputRequired, Length, Email, EqualTo, Regexp
-from app.services import AuthService
+
+
+def check_user_by_email(form, field):
+    """Валидатор уникальности e-mail; сервис импортируется при проверке, а не при импорте форм"""
+    from app.services import AuthService
+    AuthService.check_user_by_email(form, field)
+
+
+def check_user_by_phone(form, field):
+    """Валидатор уникальности номера телефона"""
+    from app.services import AuthService
+    AuthService.check_user_by_phone(form, field)
 
 
 class RegistrationForm(FlaskForm):
@@ -26,7 +37,7 @@ class RegistrationForm(FlaskForm):
         validators=[
             InputRequired(message='Введите e-mail'),
             Email(),
-            AuthService.check_user_by_email
+            check_user_by_email
         ]
     )
     phone = StringField(
@@ -37,7 +48,7 @@ class RegistrationForm(FlaskForm):
                 r'^(\+7|8)\d{10}$',
                 message='Номер должен быть в формате +7XXXXXXXXXX или 8XXXXXXXXXX (11 цифр)'
             ),
-            AuthService.check_user_by_phone
+            check_user_by_phone
         ]
     )
     password = PasswordField(
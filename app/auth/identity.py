@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from flask_login import UserMixin
+from app.config import settings
+
+
+@dataclass(frozen=True)
+class UserIdentity(UserMixin):
+    """Облегченная неизменяемая запись пользователя для Flask-Login"""
+    id: int
+    name: str
+    surname: str
+    email: str
+
+
+class UserCache:
+    """Ограниченный LRU-кэш записей пользователей со сроком жизни"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is None or item[1] <= now:
+                if item is not None:
+                    del self._items[user_id]
+                self.misses += 1
+                return None
+            self._items.move_to_end(user_id)
+            self.hits += 1
+            return item[0]
+
+    def put(self, identity):
+        with self._lock:
+            self._items[identity.id] = (identity, time.monotonic() + self.ttl)
+            self._items.move_to_end(identity.id)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._items.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        """Счетчики попаданий и промахов кэша"""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self._items),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / requests if requests else 0.0
+            }
+
+
+user_cache = UserCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
@@ -1,6 +1,6 @@
 from flask import Blueprint, flash, session, redirect, render_template, url_for
 from werkzeug.security import check_password_hash
-from flask_login import login_user, logout_user
+from flask_login import login_user, logout_user, current_user
 from random import randint
 from app.database import session_scope
 from app.models import User
@@ -11,6 +11,7 @@ from app.auth.forms import (RegistrationForm,
                             ResetPasswordNewForm)
 from app.exceptions import UserDoesNotExistError, DatabaseOperationError, DataAccessError
 from app.services import AuthService
+from app.auth.identity import user_cache
 
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
@@ -127,6 +128,8 @@ def reset_password(step):
 
 @auth_bp.route('/logout')
 def logout():
+    if current_user.is_authenticated:
+        user_cache.invalidate(current_user.id)
     logout_user()
     return redirect(url_for('books.home'))
 
@@ -1,20 +1,37 @@
-from flask import Blueprint, flash, redirect, render_template, url_for, request
+import hashlib
+from datetime import datetime
+from flask import Blueprint, flash, redirect, render_template, url_for, request, session, make_response
 from flask_login import current_user
 from app.services import BookService
-from app.exceptions import DatabaseOperationError, DataAccessError, BookNotFoundError, BooksNotFoundError
+from app.fragment_cache import LazyValue
+from app.exceptions import (DatabaseOperationError, DataAccessError, BookNotFoundError, BooksNotFoundError,
+                            ReviewExistsError, OutOfStockError)
 
 books_bp = Blueprint('books', __name__)
 
+SORT_OPTIONS = {
+    'rating': 'По рейтингу',
+    'year': 'Сначала новые',
+    'price': 'Сначала дешевые',
+    'title': 'По названию'
+}
+REVIEW_SORT_OPTIONS = {
+    'newest': 'Сначала новые',
+    'rating': 'Сначала с высокой оценкой'
+}
+
 
 @books_bp.route('/')
 def home():
     try:
-        top_books = BookService.get_top_books()
-        top_books_by_genre = BookService.get_top_books_by_genre()
+        # ТОП недели меняется и с новыми заказами, и со сменой недели
+        cache_version = f'{BookService.get_catalog_version()}:{BookService.week_period(datetime.now())}'
+        # запросы ТОПов выполняются, только если фрагменты нужно отрендерить заново
         return render_template(
             'books/home.html',
-            top_books=top_books,
-            top_books_by_genre=top_books_by_genre
+            top_books=LazyValue(BookService.get_top_books),
+            top_books_by_genre=LazyValue(BookService.get_top_books_by_genre),
+            cache_version=cache_version
         )
 
     except BooksNotFoundError:
@@ -34,13 +51,11 @@ def home():
 @books_bp.route('/catalog')
 def catalog():
     try:
-        books_by_genre = BookService.get_books_by_genre()
-        if not books_by_genre:
-            flash('Каталог пуст', 'error')
-            return render_template('books/home.html', top_books=[], top_books_by_genre={})
-        return render_template('books/catalog.html', books_by_genre=books_by_genre)
+        genres = BookService.get_catalog_overview()
+        return render_template('books/catalog.html', genres=genres,
+                               cache_version=BookService.get_catalog_version())
     except BooksNotFoundError:
-        flash('Книги не найдены', 'error')
+        flash('Каталог пуст', 'error')
         return render_template('books/home.html', top_books=[], top_books_by_genre={})
     except (DatabaseOperationError, DataAccessError):
         flash('Проблемы с базой данных', 'error')
@@ -50,6 +65,27 @@ def catalog():
         return render_template('books/home.html', top_books=[], top_books_by_genre={})
 
 
+@books_bp.route('/catalog/<genre>')
+def genre(genre):
+    try:
+        sort = request.args.get('sort', 'rating')
+        cursor = request.args.get('cursor')
+        page = BookService.get_genre_page(genre, sort=sort, cursor=cursor)
+        return render_template('books/genre.html', page=page, sort_options=SORT_OPTIONS)
+    except BooksNotFoundError:
+        flash('Книги не найдены', 'error')
+        return redirect(url_for('books.catalog'))
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('books.genre', genre=genre))
+    except (DatabaseOperationError, DataAccessError):
+        flash('Проблемы с базой данных', 'error')
+        return render_template('books/home.html', top_books=[], top_books_by_genre={})
+    except Exception as e:
+        print(f'Произошла ошибка: {e}')
+        return render_template('books/home.html', top_books=[], top_books_by_genre={})
+
+
 @books_bp.route('/search', methods=['POST'])
 def search():
     try:
@@ -57,8 +93,14 @@ def search():
         if not search_query or len(search_query.strip()) <= 2:
             flash('Слишком короткий запрос', 'error')
             return redirect(url_for('books.home'))
-        result = BookService.search_book(search_query)
-        return render_template('books/search-result.html', result=result, search_query=search_query)
+        page = request.form.get('page', 1, type=int)
+        result = BookService.search_book(search_query, page=page)
+        return render_template('books/search-result.html',
+                               result=result['items'],
+                               search_query=search_query,
+                               page=result['page'],
+                               pages=result['pages'],
+                               total=result['total'])
     except BooksNotFoundError:
         flash('Книги не найдены', 'error')
         return render_template('books/home.html', top_books=[], top_books_by_genre={})
@@ -67,16 +109,35 @@ def search():
         return render_template('books/home.html', top_books=[], top_books_by_genre={})
 
 
+def _book_etag(book_id, version, book_quantity):
+    """ETag страницы книги: версия книги, доступный остаток, пользователь и параметры страницы отзывов"""
+    user_id = current_user.get_id() if current_user.is_authenticated else ''
+    args = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items(multi=True)))
+    return hashlib.sha1(f'{book_id}:{version}:{book_quantity}:{user_id}:{args}'.encode('utf-8')).hexdigest()
+
+
+def _with_validators(response, book_id, version, book_quantity):
+    # без Last-Modified: страница зависит от пользователя и параметров, а не только от времени изменения книги,
+    # и If-Modified-Since без ETag вернул бы 304 на чужую версию страницы
+    response.set_etag(_book_etag(book_id, version, book_quantity))
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
 @books_bp.route('/books/<book_id>', methods=['GET', 'POST'])
 def book(book_id):
     try:
-        book_by_id = BookService.get_book_by_id(book_id)
-        reviews = BookService.get_reviews_by_book_id(book_id)
-        book_quantity = BookService.check_book_quantity(book_id)
-
-        if not book_by_id:
-            flash('Книга не найдена', 'error')
-            return render_template('books/home.html')
+        # страница с ожидающими flash-сообщениями не должна кэшироваться и отдаваться как 304
+        conditional = request.method == 'GET' and '_flashes' not in session
+        user_id = current_user.id if current_user.is_authenticated else None
+        if conditional:
+            version, book_quantity = BookService.get_book_validators(book_id, user_id)
+            response = _with_validators(make_response('', 200), book_id, version, book_quantity)
+            response.make_conditional(request)
+            if response.status_code == 304:
+                return response
 
         form_type = request.form.get('form_type')
 
@@ -87,6 +148,8 @@ def book(book_id):
                 try:
                     BookService.add_review(review_text, current_user.id, book_id, rating)
                     flash('Отзыв успешно добавлен', 'success')
+                except ReviewExistsError as e:
+                    flash(str(e), 'error')
                 except Exception as e:
                     print(f'Произошла ошибка: {e}')
                     flash('Ошибка добавления отзыва', 'error')
@@ -98,6 +161,8 @@ def book(book_id):
                 try:
                     BookService.update_cart(current_user.id, book_id)
                     flash('Книга добавлена в корзину', 'success')
+                except OutOfStockError as e:
+                    flash(str(e), 'error')
                 except Exception as e:
                     print(f'Произошла ошибка: {e}')
                     flash(f'Ошибка добавления книги в корзину', 'error')
@@ -105,11 +170,23 @@ def book(book_id):
             else:
                 flash('Для добавления книги в корзину необходимо авторизоваться', 'error')
 
-        return render_template(
+        try:
+            page = BookService.get_book_page(book_id, user_id,
+                                             reviews_sort=request.args.get('reviews_sort', 'newest'),
+                                             reviews_cursor=request.args.get('reviews_cursor'))
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('books.book', book_id=book_id))
+
+        response = make_response(render_template(
             'books/book.html',
-            book=book_by_id, reviews=reviews,
-            book_quantity=book_quantity
-        )
+            book=page['book'], reviews=page['reviews'],
+            book_quantity=page['book_quantity'],
+            review_sort_options=REVIEW_SORT_OPTIONS
+        ))
+        if conditional:
+            _with_validators(response, book_id, page['version'], page['book_quantity'])
+        return response
 
     except BookNotFoundError:
         flash('Книга не найдена', 'error')
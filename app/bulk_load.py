@@ -0,0 +1,237 @@
+import json
+import re
+import time
+from datetime import datetime
+from decimal import Decimal
+from itertools import chain, islice
+from pathlib import Path
+from sqlalchemy import select, func
+from werkzeug.security import generate_password_hash
+from app.models import Book, Review, User, Order, OrderItem, OrderStatusEnum, OrderMethodEnum
+
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_COVER = 'img/no_pic.png'
+CHUNK_SIZE = 1 << 16
+WHITESPACE_RE = re.compile(r'\s*')
+
+
+class LoadReport:
+    """Итог загрузки одной таблицы"""
+
+    def __init__(self, table, rows, seconds):
+        self.table = table
+        self.rows = rows
+        self.seconds = seconds
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else float(self.rows)
+
+    def __str__(self):
+        return f'{self.table}: {self.rows} строк за {self.seconds:.2f} с ({self.rows_per_second:,.0f} строк/с)'
+
+
+def _iter_json_array(file):
+    """Потоково разбирает JSON-массив объектов, не читая файл целиком"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+    started = False
+
+    def refill():
+        nonlocal buffer, position, eof
+        chunk = file.read(CHUNK_SIZE)
+        if not chunk:
+            eof = True
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    while True:
+        position = WHITESPACE_RE.match(buffer, position).end()
+        if position >= len(buffer):
+            if eof:
+                raise ValueError('Неожиданный конец JSON-массива')
+            refill()
+            continue
+
+        char = buffer[position]
+        if not started:
+            if char != '[':
+                raise ValueError('Ожидался JSON-массив')
+            started = True
+            position += 1
+        elif char == ']':
+            return
+        elif char == ',':
+            position += 1
+        else:
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                refill()
+                continue
+            position = end
+            yield record
+
+
+def iter_records(path):
+    """Читает записи из .jsonl (по строке на запись) или .json (массив объектов) потоково"""
+    path = Path(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.suffix == '.jsonl':
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from _iter_json_array(f)
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _parse_datetime(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+class BulkLoader:
+    """Пакетная загрузка записей в SQLite в одной транзакции соединения connection"""
+
+    def __init__(self, connection, batch_size=DEFAULT_BATCH_SIZE):
+        self.connection = connection
+        self.batch_size = batch_size
+        self._password_hashes = {}
+
+    def _insert_batches(self, table, rows):
+        """Вставляет словари rows пакетами через executemany драйвера, возвращает число строк"""
+        batches = _batched(rows, self.batch_size)
+        first_batch = next(batches, None)
+        if not first_batch:
+            return 0
+
+        dialect = self.connection.dialect
+        columns = [table.c[key] for key in first_batch[0]]
+        processors = [column.type.dialect_impl(dialect).bind_processor(dialect) for column in columns]
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            dialect.identifier_preparer.format_table(table),
+            ', '.join(dialect.identifier_preparer.format_column(column) for column in columns),
+            ', '.join('?' for _ in columns)
+        )
+        count = 0
+        for batch in chain([first_batch], batches):
+            self.connection.exec_driver_sql(sql, [
+                tuple(value if process is None or value is None else process(value)
+                      for value, process in zip(row.values(), processors))
+                for row in batch
+            ])
+            count += len(batch)
+        return count
+
+    def _load(self, table, rows):
+        started = time.perf_counter()
+        count = self._insert_batches(table, rows)
+        return LoadReport(table.name, count, time.perf_counter() - started)
+
+    def load_books(self, records):
+        return self._load(Book.__table__, (
+            {'title': item['title'],
+             'author': item['author'],
+             'price': float(item['price']),
+             'genre': item['genre'],
+             'cover': item.get('cover') or DEFAULT_COVER,
+             'description': item['description'],
+             'pages': int(item['pages']),
+             'rating': float(item['rating']),
+             'year': int(item['year']),
+             'quantity': int(item['quantity'])}
+            for item in records
+        ))
+
+    def load_reviews(self, records):
+        return self._load(Review.__table__, (
+            {'review': item['review'],
+             'user_id': item['user_id'],
+             'book_id': item['book_id'],
+             'rating': int(item['rating'])}
+            for item in records
+        ))
+
+    def _password_hash(self, item):
+        if 'password_hash' in item:
+            return item['password_hash']
+        password = item['password']
+        # хэширование — самая дорогая часть загрузки, одинаковые пароли хэшируются один раз
+        if password not in self._password_hashes:
+            self._password_hashes[password] = generate_password_hash(password)
+        return self._password_hashes[password]
+
+    def load_users(self, records):
+        return self._load(User.__table__, (
+            {'name': item['name'],
+             'surname': item['surname'],
+             'email': item['email'],
+             'phone': item['phone'],
+             'password_hash': self._password_hash(item)}
+            for item in records
+        ))
+
+    def book_prices(self):
+        """Карта id книги -> цена одним запросом"""
+        return dict(self.connection.execute(select(Book.id, Book.price)).all())
+
+    def load_order_items(self, records, prices=None):
+        """Загружает позиции заказов, цена без явного значения берется из карты цен"""
+        prices = prices if prices is not None else self.book_prices()
+        return self._load(OrderItem.__table__, (
+            {'order_id': item['order_id'],
+             'book_id': item['book_id'],
+             'quantity': int(item.get('quantity', 1)),
+             'price': item['price'] if item.get('price') is not None else prices[item['book_id']]}
+            for item in records
+        ))
+
+    def load_orders(self, records):
+        """Загружает заказы с вложенными позициями items, возвращает отчеты по обеим таблицам"""
+        prices = self.book_prices()
+        next_id = (self.connection.execute(select(func.max(Order.id))).scalar() or 0) + 1
+        order_items = []
+
+        def orders():
+            nonlocal next_id
+            for item in records:
+                order_id = item.get('id') or next_id
+                next_id = max(next_id, order_id) + 1
+                created_at = _parse_datetime(item['created_at'])
+                item_count = 0
+                total_amount = 0
+                for line in item.get('items', ()):
+                    quantity = int(line.get('quantity', 1))
+                    price = line['price'] if line.get('price') is not None else prices[line['book_id']]
+                    item_count += quantity
+                    total_amount += quantity * Decimal(str(price))
+                    order_items.append({**line, 'order_id': order_id, 'quantity': quantity, 'price': price})
+                yield {'id': order_id,
+                       'user_id': item['user_id'],
+                       'created_at': created_at,
+                       'updated_at': _parse_datetime(item.get('updated_at') or created_at),
+                       'status': OrderStatusEnum(item.get('status', OrderStatusEnum.NEW.value)),
+                       'delivery_method': OrderMethodEnum(item['delivery_method']),
+                       'address': item['address'],
+                       'item_count': item_count,
+                       'total_amount': total_amount}
+
+        started = time.perf_counter()
+        orders_count = 0
+        items_count = 0
+        for batch in _batched(orders(), self.batch_size):
+            orders_count += self._insert_batches(Order.__table__, batch)
+            items_count += self.load_order_items(order_items, prices).rows
+            order_items.clear()
+        seconds = time.perf_counter() - started
+        return [LoadReport(Order.__tablename__, orders_count, seconds),
+                LoadReport(OrderItem.__tablename__, items_count, seconds)]
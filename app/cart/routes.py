@@ -1,7 +1,7 @@
 from flask import Blueprint, flash, redirect, render_template, url_for, request
 from flask_login import current_user, login_required
 from app.services import CartService
-from app.exceptions import DatabaseOperationError, DataAccessError, ServiceError
+from app.exceptions import DatabaseOperationError, DataAccessError, ServiceError, OutOfStockError
 
 
 cart_bp = Blueprint('cart', __name__, url_prefix='/cart')
@@ -15,9 +15,10 @@ def cart(user_id):
             return redirect(url_for('books.home'))
 
         try:
-            users_cart = CartService.get_cart(user_id)
-            available_items = CartService.get_available_items_from_cart(user_id)
-            unavailable_items = CartService.get_unavailable_items_from_cart(user_id)
+            cart_view = CartService.get_cart_view(user_id)
+            users_cart = cart_view['items']
+            available_items = cart_view['available']
+            unavailable_items = cart_view['unavailable']
         except (DatabaseOperationError, DataAccessError, ServiceError) as e:
             print(f'Произошла ошибка: {e}')
             flash('Проблемы с базой данных', 'error')
@@ -53,7 +54,7 @@ def cart(user_id):
                     elif form_type == 'add_book':
                         CartService.handle_cart_actions(item_id, 'add')
                         flash('Товар добавлен', 'success')
-                except ValueError as e:
+                except (ValueError, OutOfStockError) as e:
                     flash(str(e), 'error')
                 except (DatabaseOperationError, DataAccessError, ServiceError):
                     flash('Ошибка при обновлении корзины', 'error')
@@ -63,7 +64,9 @@ def cart(user_id):
                                user_id=user_id,
                                users_cart=users_cart,
                                available_items=available_items,
-                               unavailable_items=unavailable_items)
+                               unavailable_items=unavailable_items,
+                               total_price=cart_view['total_price'],
+                               total_quantity=cart_view['total_quantity'])
     except Exception as e:
         print(f'Произошла ошибка: {e}')
         flash('Данные временно недоступны')
@@ -0,0 +1,152 @@
+import base64
+import binascii
+import json
+import threading
+import time
+from bisect import bisect_right
+from types import MappingProxyType
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import committed_session
+from app.models import Book, CatalogState
+from app.search import SearchIndex
+
+
+class CatalogSnapshot:
+    """Неизменяемый снимок каталога: книги, индекс по id и по жанрам"""
+
+    def __init__(self, version, books):
+        self.version = version
+        self.books = tuple(MappingProxyType(book) for book in books)
+        self.by_id = MappingProxyType({book['id']: book for book in self.books})
+        by_genre = {}
+        for book in self.books:
+            by_genre.setdefault(book['genre'], []).append(book)
+        self.by_genre = MappingProxyType({genre: tuple(books) for genre, books in by_genre.items()})
+        self.genre_counts = MappingProxyType({genre: len(books) for genre, books in self.by_genre.items()})
+        self._search_index = None
+        self._search_lock = threading.Lock()
+        self._orderings = {}
+
+    @property
+    def search_index(self):
+        """Поисковый индекс строится один раз на снимок при первом обращении"""
+        if self._search_index is None:
+            with self._search_lock:
+                if self._search_index is None:
+                    self._search_index = SearchIndex(self.books)
+        return self._search_index
+
+    def _ordering(self, genre, sort):
+        """Книги жанра, отсортированные по ключу sort, и их ключи для поиска по курсору"""
+        ordering = self._orderings.get((genre, sort))
+        if ordering is None:
+            sort_key = SORT_KEYS[sort]
+            books = sorted(self.by_genre.get(genre, ()), key=sort_key)
+            ordering = ([sort_key(book) for book in books], [slim_book(book) for book in books])
+            self._orderings[(genre, sort)] = ordering
+        return ordering
+
+    def genre_page(self, genre, sort, cursor=None, limit=20):
+        """Страница книг жанра после курсора (ключ последней показанной книги)"""
+        keys, books = self._ordering(genre, sort)
+        start = bisect_right(keys, decode_cursor(cursor, sort)) if cursor else 0
+        page = books[start:start + limit]
+        has_more = start + limit < len(books)
+        return {
+            'books': page,
+            'next_cursor': encode_cursor(keys[start + limit - 1], sort) if has_more else None
+        }
+
+
+SORT_KEYS = {
+    'rating': lambda book: (-float(book['rating']), book['id']),
+    'year': lambda book: (-book['year'], book['id']),
+    'price': lambda book: (float(book['price']), book['id']),
+    'title': lambda book: (book['title'].lower(), book['id'])
+}
+SLIM_FIELDS = ('id', 'title', 'author', 'cover', 'rating', 'year', 'price')
+
+
+def slim_book(book):
+    """Только поля, нужные карточке книги в каталоге"""
+    return MappingProxyType({field: book[field] for field in SLIM_FIELDS})
+
+
+def encode_cursor(key, sort):
+    """Непрозрачный курсор из ключа сортировки последней книги страницы"""
+    payload = json.dumps([sort, list(key)], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii')
+
+
+def decode_cursor(cursor, sort, size=2):
+    try:
+        cursor_sort, key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if cursor_sort != sort or len(key) != size:
+            raise ValueError('Курсор относится к другой сортировке')
+        return tuple(key)
+    except (ValueError, TypeError, binascii.Error) as e:
+        raise ValueError(f'Некорректный курсор: {e}') from e
+
+
+_snapshot = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+@event.listens_for(Session, 'after_commit')
+def _expire_check(session):
+    global _checked_at
+    if session.info.pop('catalog_changed', False):
+        _checked_at = 0.0
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_change(session):
+    session.info.pop('catalog_changed', None)
+
+
+def bump_version(db_session):
+    """Увеличивает версию каталога в транзакции, изменившей книги, остатки или рейтинг"""
+    statement = sqlite_insert(CatalogState).values(id=1, version=1)
+    db_session.execute(statement.on_conflict_do_update(
+        index_elements=[CatalogState.id],
+        set_={'version': CatalogState.version + 1}
+    ))
+    db_session.info['catalog_changed'] = True
+
+
+def _read_version(db_session):
+    return db_session.query(CatalogState.version).filter_by(id=1).scalar() or 0
+
+
+def _load_books(db_session):
+    rows = (
+        db_session.query(Book.id, Book.title, Book.author, Book.price, Book.genre, Book.cover,
+                         Book.description, Book.pages, Book.rating, Book.year, Book.quantity,
+                         Book.units_sold.label('quantity_in_orders'))
+        .order_by(Book.id)
+        .all()
+    )
+    return [row._asdict() for row in rows]
+
+
+def get_snapshot():
+    """Возвращает актуальный снимок каталога, перестраивая его при смене версии"""
+    global _snapshot, _checked_at
+    snapshot = _snapshot
+    if snapshot is not None and time.monotonic() - _checked_at < settings.CATALOG_VERSION_CHECK_INTERVAL:
+        return snapshot
+
+    with _lock:
+        if _snapshot is not None and time.monotonic() - _checked_at < settings.CATALOG_VERSION_CHECK_INTERVAL:
+            return _snapshot
+        # снимок строится только из зафиксированных данных, даже если запрос сам меняет каталог
+        with committed_session() as db_session:
+            version = _read_version(db_session)
+            if _snapshot is None or _snapshot.version != version:
+                _snapshot = CatalogSnapshot(version, _load_books(db_session))
+        _checked_at = time.monotonic()
+        return _snapshot
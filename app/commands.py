@@ -1,11 +1,20 @@
 import json
-from app.database import session_scope, init_db
-from app.models import Book, Review, User, StoreAddress, Order, OrderStatusEnum, OrderMethodEnum, OrderItem
+from app.database import (session_scope, init_db, get_schema_version, set_schema_version, find_duplicate_reviews,
+                          remove_duplicate_reviews)
+from app.models import Book, Review, User, StoreAddress, Order, OrderStatusEnum, OrderMethodEnum
 from sqlalchemy.exc import DatabaseError
 from pathlib import Path
-from werkzeug.security import generate_password_hash
+from sqlalchemy import insert
 from datetime import datetime, timedelta
 import random
+import click
+from app.services import BookService, OrderService, ReservationService
+from app import assets, catalog
+from app.bulk_load import BulkLoader, DEFAULT_COVER, DEFAULT_BATCH_SIZE, iter_records
+
+
+# увеличивается при каждом изменении схемы или начальных данных, чтобы prepare_database применил их к БД
+SCHEMA_VERSION = 5
 
 
 class DatabaseInitializationError(Exception):
@@ -18,19 +27,28 @@ class DataValidationError(Exception):
     pass
 
 
-def ensure_db_exists():
-    """Создает БД и папку instance если их нет"""
-    try:
-        db_path = Path('app/instance/bookstore.db')
+def ensure_db_dir():
+    """Создает папку instance для файла БД, если ее нет"""
+    db_path = Path('app/instance/bookstore.db')
 
-        db_path.parent.mkdir(exist_ok=True)
+    db_path.parent.mkdir(exist_ok=True)
 
-        init_file = db_path.parent / '__init__.py'
-        if not init_file.exists():
-            init_file.touch()
+    init_file = db_path.parent / '__init__.py'
+    if not init_file.exists():
+        init_file.touch()
 
-        if not db_path.exists():
-            init_db()
+
+def ensure_db_exists():
+    """Создает БД и папку instance если их нет"""
+    try:
+        ensure_db_dir()
+
+        init_db()
+        # схема отставала от SCHEMA_VERSION: агрегаты пересчитываются по накопленным данным,
+        # в том числе если прошлая попытка добавила столбцы, но не успела их заполнить
+        BookService.rebuild_rating_stats()
+        BookService.verify_units_sold(fix=True)
+        OrderService.rebuild_order_totals()
     except PermissionError as e:
         raise DatabaseInitializationError(f"Ошибка прав доступа при создании БД: {e}")
     except Exception as e:
@@ -50,28 +68,13 @@ def init_books():
                 return
 
             try:
-                with open('app/files/books_catalog.json', 'r', encoding='utf-8') as f:
-                    books_data = json.load(f)
-
-                for item in books_data:
-                    try:
-                        book = Book(title=item['title'],
-                                    author=item['author'],
-                                    price=float(item['price']),
-                                    genre=item['genre'],
-                                    cover='img/no_pic.png',
-                                    description=item['description'],
-                                    pages=int(item['pages']),
-                                    rating=float(item['rating']),
-                                    year=int(item['year']),
-                                    quantity=int(item['quantity'])
-                                    )
-                        db_session.add(book)
-                    except (KeyError, ValueError, TypeError) as e:
-                        raise DataValidationError(f"Ошибка в данных книги: {e}")
-
+                loader = BulkLoader(db_session.connection())
+                loader.load_books({**item, 'cover': DEFAULT_COVER} for item in iter_records(json_path))
+                catalog.bump_version(db_session)
             except json.JSONDecodeError as e:
                 raise DataValidationError(f"Ошибка в формате JSON: {e}")
+            except (KeyError, ValueError, TypeError) as e:
+                raise DataValidationError(f"Ошибка в данных книги: {e}")
     except DatabaseError as db_error:
         raise DatabaseInitializationError(f"Ошибка базы данных: {db_error}")
     except Exception as e:
@@ -90,20 +93,12 @@ def init_reviews():
                 return
 
             try:
-                with open('app/files/first_reviews.json', 'r', encoding='utf-8') as f:
-                    reviews_data = json.load(f)
-                for item in reviews_data:
-                    try:
-                        review = Review(review=item['review'],
-                                        user_id=item['user_id'],
-                                        book_id=item['book_id'],
-                                        rating=item['rating']
-                                    )
-                        db_session.add(review)
-                    except (KeyError, ValueError) as e:
-                        raise DataValidationError(f"Ошибка в данных отзыва: {e}")
+                BulkLoader(db_session.connection()).load_reviews(iter_records(json_path))
+                catalog.bump_version(db_session)
             except json.JSONDecodeError as e:
                 raise DataValidationError(f"Ошибка в формате JSON: {e}")
+            except (KeyError, ValueError, TypeError) as e:
+                raise DataValidationError(f"Ошибка в данных отзыва: {e}")
 
     except DatabaseError as db_error:
         raise DatabaseInitializationError(f"Ошибка базы данных: {db_error}")
@@ -189,19 +184,10 @@ def init_users():
         with session_scope() as db_session:
             if db_session.query(User).first():
                 return
-            for user in users:
-                try:
-                    if not db_session.query(User).filter_by(email=user['email']).first():
-                        hashed_password = generate_password_hash(user['password'])
-                        db_session.add(User(
-                            name=user['name'],
-                            surname=user['surname'],
-                            email=user['email'],
-                            phone=user['phone'],
-                            password_hash=hashed_password
-                        ))
-                except (KeyError, ValueError) as e:
-                    raise DataValidationError(f"Ошибка в данных пользователя: {e}")
+            try:
+                BulkLoader(db_session.connection()).load_users(users)
+            except (KeyError, ValueError) as e:
+                raise DataValidationError(f"Ошибка в данных пользователя: {e}")
     except DatabaseError as db_error:
         raise DatabaseInitializationError(f"Ошибка базы данных: {db_error}")
     except Exception as e:
@@ -278,6 +264,7 @@ def init_store_address():
         with session_scope() as db_session:
             if db_session.query(StoreAddress).first():
                 return
+            full_addresses = {}
             for store_address in store_addresses:
                 try:
                     full_address = (
@@ -286,10 +273,10 @@ def init_store_address():
                         f'д. {store_address["house"]}, '
                         f'к. {store_address["building"]}'
                     )
-                    if not db_session.query(StoreAddress).filter_by(store_address=full_address).first():
-                        db_session.add(StoreAddress(store_address=full_address))
+                    full_addresses[full_address] = {'store_address': full_address}
                 except (KeyError, ValueError) as e:
                     raise DataValidationError(f"Ошибка в данных адреса: {e}")
+            db_session.execute(insert(StoreAddress), list(full_addresses.values()))
     except DatabaseError as db_error:
         raise DatabaseInitializationError(f"Ошибка базы данных: {db_error}")
     except Exception as e:
@@ -354,24 +341,20 @@ def create_order_item(created_orders_ids):
     """Создает таблицу с товарами в заказах"""
     try:
         with session_scope() as db_session:
+            loader = BulkLoader(db_session.connection())
+            prices = loader.book_prices()
+            order_items = []
             for order_id in created_orders_ids:
-                try:
-                    items_count = random.randint(1, 10)
-
-                    for _ in range(items_count):
-                        book_id = random.randint(1, 100)
-                        quantity = random.randint(1, 3)
-                        price = db_session.query(Book).filter_by(id=book_id).first().price
-
-                        order_item = OrderItem(
-                            order_id=order_id,
-                            book_id=book_id,
-                            quantity=quantity,
-                            price=price
-                        )
-                        db_session.add(order_item)
-                except (ValueError, AttributeError) as e:
-                    raise DataValidationError(f"Ошибка в данных элемента заказа: {e}")
+                items_count = random.randint(1, 10)
+                for _ in range(items_count):
+                    order_items.append({'order_id': order_id,
+                                        'book_id': random.randint(1, 100),
+                                        'quantity': random.randint(1, 3)})
+            try:
+                loader.load_order_items(order_items, prices)
+            except (ValueError, KeyError) as e:
+                raise DataValidationError(f"Ошибка в данных элемента заказа: {e}")
+            catalog.bump_version(db_session)
     except DatabaseError as db_error:
         raise DatabaseInitializationError(f"Ошибка базы данных: {db_error}")
     except Exception as e:
@@ -386,11 +369,113 @@ def init_orders():
                 return
         created_orders_ids = create_orders()
         create_order_item(created_orders_ids)
+        BookService.rebuild_sales_stats()
+        OrderService.rebuild_order_totals()
     except DatabaseInitializationError:
         raise
     except Exception as e:
         raise DatabaseInitializationError(f"Неожиданная ошибка при инициализации заказов: {e}")
 
 
-
-
+def prepare_database(force=False):
+    """Создает и дополняет схему и заполняет начальные данные, если версия БД отстает от SCHEMA_VERSION"""
+    ensure_db_dir()
+    if not force and get_schema_version() >= SCHEMA_VERSION:
+        return False
+    ensure_db_exists()
+    init_books()
+    init_users()
+    init_reviews()
+    init_store_address()
+    init_orders()
+    set_schema_version(SCHEMA_VERSION)
+    return True
+
+
+def register_commands(app):
+    """Регистрирует CLI-команды обслуживания БД"""
+
+    @app.cli.command('init-db')
+    @click.option('--force', is_flag=True, help='Выполнить, даже если версия БД актуальна')
+    def init_db_command(force):
+        """Создает и дополняет схему БД и заполняет начальные данные"""
+        if prepare_database(force=force):
+            click.echo(f'БД подготовлена, версия схемы {SCHEMA_VERSION}')
+        else:
+            click.echo(f'БД актуальна, версия схемы {SCHEMA_VERSION}')
+
+    @app.cli.command('rebuild-sales')
+    def rebuild_sales_command():
+        """Пересчитывает агрегаты продаж книг по истории заказов"""
+        books_count = BookService.rebuild_sales_stats()
+        click.echo(f'Агрегаты продаж пересчитаны, книг с продажами: {books_count}')
+
+    @app.cli.command('rebuild-ratings')
+    def rebuild_ratings_command():
+        """Пересчитывает число отзывов, распределение оценок и рейтинг книг по таблице отзывов"""
+        books_count = BookService.rebuild_rating_stats()
+        click.echo(f'Рейтинги пересчитаны, книг с отзывами: {books_count}')
+
+    @app.cli.command('dedupe-reviews')
+    def dedupe_reviews_command():
+        """Удаляет повторные отзывы пользователя на одну книгу, оставляя самый ранний"""
+        with session_scope() as db_session:
+            connection = db_session.connection()
+            for user_id, book_id in find_duplicate_reviews(connection):
+                click.echo(f'Пользователь {user_id}, книга {book_id}')
+            removed = remove_duplicate_reviews(connection)
+        click.echo(f'Удалено повторных отзывов: {removed}')
+
+    @app.cli.command('rebuild-order-totals')
+    def rebuild_order_totals_command():
+        """Пересчитывает сумму и число товаров заказов по их позициям"""
+        orders_count = OrderService.rebuild_order_totals()
+        click.echo(f'Итоги заказов пересчитаны, заказов с позициями: {orders_count}')
+
+    @app.cli.command('sweep-reservations')
+    def sweep_reservations_command():
+        """Удаляет истекшие резервы книг"""
+        click.echo(f'Снято истекших резервов: {ReservationService.sweep_expired()}')
+
+    @app.cli.command('verify-units-sold')
+    @click.option('--fix', is_flag=True, help='Исправить найденные расхождения')
+    def verify_units_sold_command(fix):
+        """Проверяет счетчики проданных экземпляров книг по позициям заказов"""
+        drift = BookService.verify_units_sold(fix=fix)
+        for book_id, stored, actual in drift[:20]:
+            click.echo(f'Книга {book_id}: в счетчике {stored}, по заказам {actual}')
+        if len(drift) > 20:
+            click.echo(f'... и еще {len(drift) - 20}')
+        if not drift:
+            click.echo('Расхождений нет')
+        elif fix:
+            click.echo(f'Исправлено книг: {len(drift)}')
+        else:
+            click.echo(f'Книг с расхождениями: {len(drift)}, запустите с --fix для исправления')
+            raise SystemExit(1)
+
+    @app.cli.command('build-assets')
+    @click.option('--no-brotli', is_flag=True, help='Не создавать .br варианты')
+    def build_assets_command(no_brotli):
+        """Собирает статику: имена с хэшем содержимого, .gz/.br варианты и манифест"""
+        if not no_brotli and assets.brotli is None:
+            click.echo('Пакет brotli не установлен, .br варианты не создаются')
+        manifest = assets.build_assets(app.static_folder, use_brotli=not no_brotli)
+        assets.set_manifest(app, manifest)
+        click.echo(f'Собрано файлов: {len(manifest)}')
+
+    @app.cli.command('bulk-load')
+    @click.argument('kind', type=click.Choice(['books', 'reviews', 'users', 'orders']))
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, help='Строк в одном пакете')
+    def bulk_load_command(kind, path, batch_size):
+        """Загружает записи из .json или .jsonl файла одной транзакцией"""
+        with session_scope() as db_session:
+            loader = BulkLoader(db_session.connection(), batch_size=batch_size)
+            reports = getattr(loader, f'load_{kind}')(iter_records(path))
+            catalog.bump_version(db_session)
+        for report in reports if isinstance(reports, list) else [reports]:
+            click.echo(str(report))
+        if kind == 'orders':
+            BookService.rebuild_sales_stats()
+            click.echo('Агрегаты продаж пересчитаны')
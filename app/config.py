@@ -1,3 +1,5 @@
+import threading
+from typing import Literal, Optional
 from pydantic_settings import BaseSettings
 
 
@@ -5,13 +7,63 @@ class Settings(BaseSettings):
     DATABASE_URL: str
     SECRET_KEY: str
     APP_PORT: int
+    CATALOG_VERSION_CHECK_INTERVAL: float = 1.0
+    CATALOG_PAGE_SIZE: int = 20
+    REVIEWS_PAGE_SIZE: int = 10
+    ORDERS_PAGE_SIZE: int = 20
+
+    DB_JOURNAL_MODE: Literal['WAL', 'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'OFF'] = 'WAL'
+    DB_SYNCHRONOUS: Literal['OFF', 'NORMAL', 'FULL', 'EXTRA'] = 'NORMAL'
+    DB_BUSY_TIMEOUT_MS: int = 5000
+    DB_MMAP_SIZE: int = 256 * 1024 * 1024
+    DB_CACHE_SIZE_KIB: int = 64 * 1024
+    DB_TEMP_STORE: Literal['DEFAULT', 'FILE', 'MEMORY'] = 'MEMORY'
+    DB_POOL: Literal['queue', 'null', 'singleton'] = 'queue'
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+
+    RESERVATION_TTL: float = 15 * 60
+    RESERVATION_SWEEP_INTERVAL: float = 60.0
+
+    USER_CACHE_SIZE: int = 1024
+    USER_CACHE_TTL: float = 300.0
+    FRAGMENT_CACHE_ENABLED: bool = True
+    FRAGMENT_CACHE_MAX_BYTES: int = 8 * 1024 * 1024
+
+    METRICS_ENABLED: bool = True
+    METRICS_DIR: Optional[str] = None
+    METRICS_FLUSH_INTERVAL: float = 1.0
+
+    NPLUSONE_DETECT: bool = False
+    NPLUSONE_THRESHOLD: int = 3
 
     class Config:
         env_file = '.env'
 
 
-try:
-    settings = Settings()
-except Exception as e:
-    raise RuntimeError(f'Ошибка загрузки настроек: {e}')
+_settings = None
+_settings_lock = threading.Lock()
+
+
+def get_settings():
+    """Настройки приложения; окружение и .env читаются при первом обращении"""
+    global _settings
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                try:
+                    _settings = Settings()
+                except Exception as e:
+                    raise RuntimeError(f'Ошибка загрузки настроек: {e}')
+    return _settings
+
+
+class LazySettings:
+    """Прокси к настройкам: импорт модулей не загружает настройки"""
+
+    def __getattr__(self, name):
+        return getattr(get_settings(), name)
+
+
+settings = LazySettings()
 
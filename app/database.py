@@ -1,19 +1,302 @@
-from sqlalchemy import create_engine
+import logging
+import threading
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, scoped_session
-from app.models import Base
+from sqlalchemy.pool import QueuePool, NullPool, SingletonThreadPool
+from app.models import Base, SCHEMA_TRIGGERS
+from app.exceptions import DuplicateReviewsError
 from contextlib import contextmanager
+from flask import g, has_request_context
 from app.config import settings
 
-engine = create_engine(settings.DATABASE_URL)
-SessionLocal = scoped_session(sessionmaker(bind=engine, autocommit=False))
+logger = logging.getLogger(__name__)
+
+# параметр выполнения соединения, с которым транзакция начинается как BEGIN IMMEDIATE
+WRITE_OPTION = 'sqlite_write_transaction'
+
+POOL_CLASSES = {
+    'queue': QueuePool,
+    'null': NullPool,
+    'singleton': SingletonThreadPool
+}
+
+
+def engine_options(config):
+    """Параметры create_engine для выбранного в настройках пула соединений"""
+    options = {'poolclass': POOL_CLASSES[config.DB_POOL]}
+    if config.DB_POOL == 'queue':
+        options['pool_size'] = config.DB_POOL_SIZE
+        options['max_overflow'] = config.DB_MAX_OVERFLOW
+    return options
+
+
+def sqlite_pragmas(config):
+    """PRAGMA, применяемые к каждому новому соединению SQLite"""
+    return [
+        f'PRAGMA journal_mode = {config.DB_JOURNAL_MODE}',
+        f'PRAGMA synchronous = {config.DB_SYNCHRONOUS}',
+        f'PRAGMA busy_timeout = {int(config.DB_BUSY_TIMEOUT_MS)}',
+        f'PRAGMA mmap_size = {int(config.DB_MMAP_SIZE)}',
+        f'PRAGMA cache_size = -{int(config.DB_CACHE_SIZE_KIB)}',
+        f'PRAGMA temp_store = {config.DB_TEMP_STORE}'
+    ]
+
+
+def build_engine(config):
+    """Создает движок БД по профилю из настроек"""
+    new_engine = create_engine(config.DATABASE_URL, **engine_options(config))
+    if make_url(config.DATABASE_URL).get_backend_name() == 'sqlite':
+        pragmas = sqlite_pragmas(config)
+
+        @event.listens_for(new_engine, 'connect')
+        def apply_pragmas(dbapi_connection, connection_record):
+            # транзакциями управляет SQLAlchemy, иначе pysqlite ломает SAVEPOINT
+            dbapi_connection.isolation_level = None
+            cursor = dbapi_connection.cursor()
+            try:
+                for pragma in pragmas:
+                    cursor.execute(pragma)
+            finally:
+                cursor.close()
+
+        @event.listens_for(new_engine, 'begin')
+        def begin_transaction(connection):
+            # транзакция записи сразу берет блокировку записи, ожидая ее не дольше busy_timeout;
+            # отложенную транзакцию, уже читавшую данные, SQLite до записи не повышает, а сразу
+            # отвечает database is locked, не дожидаясь busy_timeout
+            if connection.get_execution_options().get(WRITE_OPTION):
+                connection.exec_driver_sql('BEGIN IMMEDIATE')
+            else:
+                connection.exec_driver_sql('BEGIN')
+
+    return new_engine
+
+
+SessionFactory = sessionmaker(autocommit=False)
+SessionLocal = scoped_session(SessionFactory)
+_engine = None
+_engine_lock = threading.Lock()
+_engine_callbacks = []
+
+
+def get_engine():
+    """Движок БД: создается при первом обращении, а не при импорте модуля"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                new_engine = build_engine(settings)
+                SessionFactory.configure(bind=new_engine)
+                for callback in _engine_callbacks:
+                    callback(new_engine)
+                _engine = new_engine
+    return _engine
+
+
+def on_engine_created(callback):
+    """Вызывает callback(engine) для движка: сразу, если он уже создан, иначе при создании"""
+    with _engine_lock:
+        if _engine is None:
+            if callback not in _engine_callbacks:
+                _engine_callbacks.append(callback)
+            return
+    callback(_engine)
+
+
+def __getattr__(name):
+    # database.engine остается доступным как атрибут модуля
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def init_db():
+    """Создает недостающие таблицы и доводит схему существующей БД, возвращает добавленные столбцы"""
+    engine = get_engine()
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        return migrate_db(connection)
+
+
+def get_schema_version():
+    """Версия схемы и начальных данных, записанная в БД (PRAGMA user_version)"""
+    with get_engine().connect() as connection:
+        return connection.exec_driver_sql('PRAGMA user_version').scalar()
+
+
+def set_schema_version(version):
+    with get_engine().begin() as connection:
+        connection.exec_driver_sql(f'PRAGMA user_version = {int(version)}')
+
+
+def migrate_db(connection):
+    """Добавляет в существующие таблицы недостающие столбцы, индексы и триггеры"""
+    inspector = inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in present:
+                continue
+            ddl = (f'ALTER TABLE {preparer.format_table(table)} '
+                   f'ADD COLUMN {preparer.format_column(column)} {column.type.compile(connection.dialect)}')
+            if column.server_default is not None:
+                ddl += f' NOT NULL DEFAULT {column.server_default.arg.text}'
+            connection.exec_driver_sql(ddl)
+            added.append(f'{table.name}.{column.name}')
+            logger.info('Добавлен столбец %s.%s', table.name, column.name)
+
+    if 'ux_reviews_user_book' not in {index['name'] for index in inspector.get_indexes('reviews')}:
+        # отзывы пользователей миграция не удаляет: уникальный индекс создается только без повторов
+        duplicates = find_duplicate_reviews(connection)
+        if duplicates:
+            pairs = ', '.join(f'({user_id}, {book_id})' for user_id, book_id in duplicates[:20])
+            more = f' и еще {len(duplicates) - 20}' if len(duplicates) > 20 else ''
+            raise DuplicateReviewsError(
+                f'Повторные отзывы пользователей на одну книгу (user_id, book_id): {pairs}{more}. '
+                f'Удалите лишние командой flask dedupe-reviews и повторите подготовку БД'
+            )
+
+    # create_all не добавляет индексы в уже существующие таблицы
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
+    if connection.dialect.name == 'sqlite':
+        for trigger in SCHEMA_TRIGGERS:
+            connection.exec_driver_sql(trigger)
+    return added
+
+
+def find_duplicate_reviews(connection):
+    """Пары (user_id, book_id), по которым у пользователя больше одного отзыва на книгу"""
+    return [tuple(row) for row in connection.exec_driver_sql(
+        'SELECT user_id, book_id FROM reviews WHERE user_id IS NOT NULL '
+        'GROUP BY user_id, book_id HAVING COUNT(*) > 1 ORDER BY user_id, book_id'
+    )]
+
+
+def remove_duplicate_reviews(connection):
+    """Оставляет от повторных отзывов пользователя на одну книгу самый ранний, возвращает число удаленных"""
+    return connection.exec_driver_sql(
+        'DELETE FROM reviews WHERE user_id IS NOT NULL AND id NOT IN '
+        '(SELECT MIN(id) FROM reviews WHERE user_id IS NOT NULL GROUP BY user_id, book_id)'
+    ).rowcount
+
+
+def check_engine():
+    """Проверяет соединение с БД и пишет в лог фактические параметры движка"""
+    engine = get_engine()
+    effective = {'pool': type(engine.pool).__name__}
+    with engine.connect() as connection:
+        if engine.dialect.name == 'sqlite':
+            for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size', 'temp_store'):
+                effective[name] = connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+            if str(effective['journal_mode']).upper() != settings.DB_JOURNAL_MODE:
+                logger.warning('Режим журнала БД %s вместо %s', effective['journal_mode'], settings.DB_JOURNAL_MODE)
+    logger.info('Параметры БД: %s', ', '.join(f'{key}={value}' for key, value in effective.items()))
+    return effective
+
+
+def get_session():
+    """Сессия текущего запроса: открывается при первом обращении, завершается в конце запроса"""
+    if 'db_session' not in g:
+        get_engine()
+        g.db_session = SessionFactory()
+    return g.db_session
+
+
+def init_app(app):
+    """Подключает к приложению единицу работы на запрос"""
+
+    @app.after_request
+    def commit_session(response):
+        db_session = g.get('db_session')
+        if db_session is not None and response.status_code < 500:
+            db_session.commit()
+        return response
+
+    @app.teardown_request
+    def close_session(exc):
+        db_session = g.pop('db_session', None)
+        if db_session is not None:
+            try:
+                if db_session.in_transaction():
+                    db_session.rollback()
+            finally:
+                db_session.close()
+
+
+def begin_write(session):
+    """Переводит сессию в транзакцию записи, если она еще не в ней; True, если транзакция начата здесь"""
+    if session.in_transaction():
+        if session.connection().get_execution_options().get(WRITE_OPTION):
+            return False
+        # до записи сессия только читала (например, пользователя в load_user); повышать эту
+        # транзакцию нельзя, поэтому она фиксируется и вместо нее начинается транзакция записи
+        session.commit()
+    session.connection(execution_options={WRITE_OPTION: True})
+    return True
+
+
+@contextmanager
+def transaction():
+    """Транзакция записи: в запросе — в сессии запроса (вложенная — SAVEPOINT), вне запроса — отдельная сессия"""
+    if not has_request_context():
+        with session_scope() as session:
+            begin_write(session)
+            yield session
+        return
+
+    session = get_session()
+    if begin_write(session):
+        # внешняя транзакция фиксируется сразу, не удерживая блокировку записи до конца запроса
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        return
+
+    savepoint = session.begin_nested()
+    try:
+        yield session
+        savepoint.commit()
+    except Exception:
+        if savepoint.is_active:
+            savepoint.rollback()
+        raise
+
+
+@contextmanager
+def committed_session():
+    """Отдельная от сессии запроса сессия для чтения: видит только зафиксированные данные"""
+    get_engine()
+    session = SessionFactory()
+    try:
+        yield session
+    finally:
+        session.close()
 
 
 @contextmanager
 def session_scope():
+    if has_request_context():
+        session = get_session()
+        try:
+            yield session
+        except Exception:
+            if not session.is_active:
+                session.rollback()
+            raise
+        return
+
+    get_engine()
     session = SessionLocal()
     try:
         yield session
@@ -23,7 +306,3 @@ def session_scope():
         raise
     finally:
         session.close()
-
-
-
-
@@ -22,14 +22,13 @@ class ReviewExistsError(Exception):
     """Проверка наличия отзыва от пользователя"""
 
 
-class BooksNotFoundError(Exception):
-    """Книги не найдены в БД"""
-
-
-
-
-
+class DuplicateReviewsError(Exception):
+    """В БД есть повторные отзывы пользователя на одну книгу"""
 
 
+class BooksNotFoundError(Exception):
+    """Книги не найдены в БД"""
 
 
+class OutOfStockError(Exception):
+    """Недостаточно экземпляров книги для оформления заказа"""
@@ -0,0 +1,17 @@
+from datetime import datetime
+
+DATETIME_FORMAT = '%d-%m-%Y %H:%M'
+
+
+def format_datetime(value, fmt=DATETIME_FORMAT):
+    """Фильтр |datetime: время в формате страниц магазина, пустая строка для отсутствующего значения"""
+    if value is None:
+        return ''
+    if not isinstance(value, datetime):
+        raise ValueError('Должен быть передан объект datetime')
+    return value.strftime(fmt)
+
+
+def init_app(app):
+    """Регистрирует фильтры шаблонов"""
+    app.add_template_filter(format_datetime, 'datetime')
@@ -0,0 +1,123 @@
+import threading
+from collections import OrderedDict
+from jinja2 import nodes, Undefined
+from jinja2.ext import Extension
+from markupsafe import Markup
+from app.config import settings
+
+
+class FragmentCache:
+    """Ограниченный по объему LRU-кэш отрендеренных фрагментов шаблонов, по одной версии на ключ"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] != version:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, version, html):
+        size = len(html.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._items[key] = (version, html, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._items.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Счетчики попаданий и промахов кэша и занятый объем"""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self._items),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / requests if requests else 0.0
+            }
+
+
+fragment_cache = FragmentCache(settings.FRAGMENT_CACHE_MAX_BYTES)
+
+
+class LazyValue:
+    """Данные для шаблона, загружаемые при первом обращении: внутри {% cache %} — только при промахе кэша"""
+
+    def __init__(self, load):
+        self._load = load
+        self._loaded = False
+        self._value = None
+
+    def _get(self):
+        if not self._loaded:
+            self._value = self._load()
+            self._loaded = True
+        return self._value
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __len__(self):
+        return len(self._get())
+
+    def __bool__(self):
+        return bool(self._get())
+
+    def __getitem__(self, key):
+        return self._get()[key]
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+
+class CacheExtension(Extension):
+    """Тег {% cache key, version %}...{% endcache %}: фрагмент рендерится заново только при смене version"""
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=fragment_cache)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = parser.parse_expression()
+        parser.stream.expect('comma')
+        version = parser.parse_expression()
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [key, version]), [], [], body).set_lineno(lineno)
+
+    def _render(self, key, version, caller):
+        # без версии (например, страница ошибки) фрагмент не кэшируется
+        if not settings.FRAGMENT_CACHE_ENABLED or version is None or isinstance(version, Undefined):
+            return caller()
+        cache = self.environment.fragment_cache
+        html = cache.get(key, version)
+        if html is None:
+            html = str(caller())
+            cache.put(key, version, html)
+        return Markup(html)
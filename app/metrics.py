@@ -0,0 +1,350 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from flask import Response, g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонный счетчик с метками"""
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """Переносит в счетчик уже накопленное значение (например, статистику кэша)"""
+        self._series[tuple(str(labels[name]) for name in self.labelnames)] = value
+
+    def dump(self):
+        return {json.dumps(key, ensure_ascii=False): value for key, value in self._series.items()}
+
+    @staticmethod
+    def merge(target, series):
+        for key, value in series.items():
+            target[key] = target.get(key, 0) + value
+
+    def render(self, series):
+        for key, value in sorted(series.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, json.loads(key))} {_format_number(value)}'
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин и метками"""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def dump(self):
+        return {json.dumps(key, ensure_ascii=False): [list(counts), total, count]
+                for key, (counts, total, count) in self._series.items()}
+
+    @staticmethod
+    def merge(target, series):
+        for key, (counts, total, count) in series.items():
+            current = target.setdefault(key, [[0] * len(counts), 0.0, 0])
+            current[0] = [a + b for a, b in zip(current[0], counts)]
+            current[1] += total
+            current[2] += count
+
+    def render(self, series):
+        for key, (counts, total, count) in sorted(series.items()):
+            labels = json.loads(key)
+            for bound, bucket_count in zip(self.buckets, counts):
+                le = _format_labels(self.labelnames, labels, [('le', _format_number(bound))])
+                yield f'{self.name}_bucket{le} {bucket_count}'
+            yield f'{self.name}_bucket{_format_labels(self.labelnames, labels, [("le", "+Inf")])} {count}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_number(total)}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, labels)} {count}'
+
+
+class MetricsRegistry:
+    """Метрики процесса; при общей папке metrics_dir суммируются по всем процессам-воркерам"""
+
+    def __init__(self, metrics_dir=None):
+        self.metrics_dir = Path(metrics_dir) if metrics_dir else None
+        self._metrics = {}
+        self._collectors = []
+        self._start_process()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _start_process(self):
+        self._lock = threading.Lock()
+        # pid может достаться новому процессу, поэтому файл различается еще и временем запуска
+        self._path = (self.metrics_dir / f'metrics-{os.getpid()}-{time.time_ns()}.json'
+                      if self.metrics_dir is not None else None)
+        self._flushed_at = 0.0
+        self._dirty = False
+        self._flusher_started = False
+
+    def _after_fork(self):
+        # блокировку в момент fork мог держать другой поток родителя, а копия родительских
+        # значений не должна попасть в метрики воркера
+        self._start_process()
+        for metric in self._metrics.values():
+            metric._series.clear()
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collector):
+        """Функция, обновляющая метрики перед выгрузкой"""
+        if collector not in self._collectors:
+            self._collectors.append(collector)
+
+    def _apply(self, update):
+        with self._lock:
+            update()
+
+    def record(self, update):
+        """Выполняет update() над метриками под блокировкой"""
+        self._apply(update)
+        self._dirty = True
+
+    def dump(self):
+        for collector in self._collectors:
+            self._apply(collector)
+        with self._lock:
+            return {name: metric.dump() for name, metric in self._metrics.items()}
+
+    def start_flusher(self):
+        """Запускает в процессе поток, дописывающий изменения в файл, даже когда воркер простаивает"""
+        if self.metrics_dir is None or self._flusher_started:
+            return
+        with self._lock:
+            if self._flusher_started:
+                return
+            self._flusher_started = True
+        threading.Thread(target=self._run_flusher, name='metrics-flusher', daemon=True).start()
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            if self._dirty:
+                try:
+                    self.flush(force=True)
+                except OSError as e:
+                    logger.warning('Ошибка записи метрик: %s', e)
+
+    def flush(self, force=False):
+        """Записывает значения процесса в файл metrics_dir, не чаще раза в METRICS_FLUSH_INTERVAL"""
+        if self.metrics_dir is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._flushed_at < settings.METRICS_FLUSH_INTERVAL:
+            return
+        self._flushed_at = now
+        self._dirty = False
+        self.metrics_dir.mkdir(parents=True, exist_ok=True)
+        temp_path = self._path.with_suffix('.tmp')
+        temp_path.write_text(json.dumps(self.dump(), ensure_ascii=False), encoding='utf-8')
+        os.replace(temp_path, self._path)
+
+    def collect(self):
+        """Значения всех процессов: файлы воркеров из metrics_dir либо память текущего процесса"""
+        if self.metrics_dir is None:
+            return self.dump()
+        self.flush(force=True)
+        merged = {}
+        for path in self.metrics_dir.glob('metrics-*.json'):
+            try:
+                data = json.loads(path.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                continue
+            for name, series in data.items():
+                metric = self._metrics.get(name)
+                if metric is not None:
+                    metric.merge(merged.setdefault(name, {}), series)
+        return merged
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus"""
+        collected = self.collect()
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            lines.extend(metric.render(collected.get(name, {})))
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry(settings.METRICS_DIR)
+REQUEST_LATENCY = registry.register(Histogram(
+    'bookstore_request_duration_seconds', 'Время обработки запроса', ('endpoint', 'method')))
+REQUESTS = registry.register(Counter(
+    'bookstore_requests_total', 'Обработанные запросы', ('endpoint', 'method', 'status')))
+REQUEST_SQL_QUERIES = registry.register(Histogram(
+    'bookstore_request_sql_queries', 'SQL-запросов за запрос', ('endpoint',), QUERY_COUNT_BUCKETS))
+REQUEST_SQL_TIME = registry.register(Histogram(
+    'bookstore_request_sql_seconds', 'Суммарное время SQL за запрос', ('endpoint',)))
+TEMPLATE_RENDER_TIME = registry.register(Histogram(
+    'bookstore_template_render_seconds', 'Время рендера шаблона Jinja', ('template',)))
+SERVICE_CALL_TIME = registry.register(Histogram(
+    'bookstore_service_call_seconds', 'Время вызова метода сервисного слоя', ('call',)))
+USER_CACHE_EVENTS = registry.register(Counter(
+    'bookstore_user_cache_events_total', 'Попадания, промахи и вытеснения кэша пользователей', ('event',)))
+FRAGMENT_CACHE_EVENTS = registry.register(Counter(
+    'bookstore_fragment_cache_events_total', 'Попадания, промахи и вытеснения кэша фрагментов шаблонов', ('event',)))
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+def _on_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _on_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    if has_request_context() and 'metrics_sql' in g:
+        g.metrics_sql[0] += 1
+        g.metrics_sql[1] += elapsed
+
+
+def _on_before_render(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault('metrics_render_start', []).append(time.perf_counter())
+
+
+def _on_rendered(sender, template, context, **extra):
+    starts = g.get('metrics_render_start') if has_request_context() else None
+    if starts:
+        elapsed = time.perf_counter() - starts.pop()
+        registry.record(lambda: TEMPLATE_RENDER_TIME.observe(elapsed, template=template.name))
+
+
+def _collect_cache_stats():
+    from app.auth.identity import user_cache
+    from app.fragment_cache import fragment_cache
+    for counter, cache in ((USER_CACHE_EVENTS, user_cache), (FRAGMENT_CACHE_EVENTS, fragment_cache)):
+        stats = cache.stats()
+        for name in ('hits', 'misses', 'evictions'):
+            counter.set(stats[name], event=name)
+
+
+def timed(call, func):
+    """Оборачивает функцию замером времени в bookstore_service_call_seconds"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            registry.record(lambda: SERVICE_CALL_TIME.observe(elapsed, call=call))
+
+    return wrapper
+
+
+def instrument_services(*service_classes):
+    """Добавляет замер времени всем публичным статическим методам сервисов"""
+    for service_class in service_classes:
+        for name, attribute in list(vars(service_class).items()):
+            if (isinstance(attribute, staticmethod) and not name.startswith('_')
+                    and not hasattr(attribute.__func__, '__wrapped__')):
+                call = f'{service_class.__name__}.{name}'
+                setattr(service_class, name, staticmethod(timed(call, attribute.__func__)))
+
+
+def metrics_view():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+def instrument_engine(engine):
+    """Подключает замер SQL-запросов к движку"""
+    if not event.contains(engine, 'before_cursor_execute', _on_before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _on_before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _on_after_cursor_execute)
+
+
+def init_app(app):
+    """Подключает сбор метрик запросов, SQL и шаблонов и эндпоинт /metrics"""
+    if not settings.METRICS_ENABLED:
+        return
+
+    from app import database
+    database.on_engine_created(instrument_engine)
+    before_render_template.connect(_on_before_render, app)
+    template_rendered.connect(_on_rendered, app)
+    registry.add_collector(_collect_cache_stats)
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        g.metrics_sql = [0, 0.0]
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        queries, sql_time = g.pop('metrics_sql', (0, 0.0))
+        endpoint = _endpoint()
+
+        def update():
+            REQUEST_LATENCY.observe(elapsed, endpoint=endpoint, method=request.method)
+            REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+            REQUEST_SQL_QUERIES.observe(queries, endpoint=endpoint)
+            REQUEST_SQL_TIME.observe(sql_time, endpoint=endpoint)
+
+        registry.record(update)
+        # поток записи запускает первый запрос воркера: в мастере gunicorn потоков быть не должно
+        registry.start_flusher()
+        registry.flush()
+        return response
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
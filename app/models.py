@@ -1,11 +1,10 @@
 from flask_login import UserMixin
-from sqlalchemy import Column, Integer, String, Numeric, ForeignKey, DateTime, CheckConstraint
+from sqlalchemy import Column, Integer, String, Numeric, ForeignKey, DateTime, CheckConstraint, Index, DDL, event
 from sqlalchemy import Enum as SQLAlchemyEnum
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import text
 from enum import Enum
-from typing import List
 
 Base = declarative_base()
 
@@ -39,16 +38,26 @@ class Book(Base):
     rating = Column(Numeric(precision=2, scale=1), nullable=False)
     year = Column(Integer, nullable=False)
     quantity = Column(Integer, nullable=False)
+    # агрегаты отзывов, поддерживаются триггерами на reviews
+    reviews_count = Column(Integer, nullable=False, server_default=text('0'))
+    rating_sum = Column(Integer, nullable=False, server_default=text('0'))
+    rating_1 = Column(Integer, nullable=False, server_default=text('0'))
+    rating_2 = Column(Integer, nullable=False, server_default=text('0'))
+    rating_3 = Column(Integer, nullable=False, server_default=text('0'))
+    rating_4 = Column(Integer, nullable=False, server_default=text('0'))
+    rating_5 = Column(Integer, nullable=False, server_default=text('0'))
+    # продано экземпляров по всем заказам, поддерживается триггерами на order_items
+    units_sold = Column(Integer, nullable=False, server_default=text('0'))
+    # версия страницы книги для ETag: растет при изменении остатка, цены и отзывов
+    version = Column(Integer, nullable=False, server_default=text('1'))
 
     in_carts = relationship('CartItem', back_populates='book', passive_deletes=True)
     in_orders = relationship('OrderItem', back_populates='book', passive_deletes=True)
     reviews = relationship('Review', back_populates='book', cascade='all, delete-orphan', passive_deletes=True)
 
-    def update_rating(self):
-        reviews: List[Review] = self.reviews
-        if reviews:
-            total = sum(review.rating for review in reviews)
-            self.rating = round(total / len(reviews), 1)
+    @property
+    def rating_histogram(self):
+        return {stars: getattr(self, f'rating_{stars}') for stars in range(5, 0, -1)}
 
 
 class CartItem(Base):
@@ -59,10 +68,33 @@ class CartItem(Base):
     book_id = Column(Integer, ForeignKey('books.id', ondelete='CASCADE'), nullable=False)
     quantity = Column(Integer, nullable=False, default=1)
 
+    __table_args__ = (
+        # ограничение чужих корзин при оформлении заказа затрагивает только корзины с этой книгой
+        Index('ix_cart_items_book_quantity', 'book_id', 'quantity'),
+    )
+
     user = relationship('User', back_populates='cart_items')
     book = relationship('Book', back_populates='in_carts')
 
 
+class Reservation(Base):
+    """Временные резервы экземпляров книг под корзины пользователей (expires_at в UTC)"""
+    __tablename__ = 'reservations'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    book_id = Column(Integer, ForeignKey('books.id', ondelete='CASCADE'), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        CheckConstraint('quantity > 0', name='check_reservation_quantity_positive'),
+        # сумма активных резервов книги читается прямо из индекса
+        Index('ix_reservations_book_expires', 'book_id', 'expires_at', 'user_id', 'quantity'),
+        Index('ix_reservations_expires', 'expires_at'),
+        Index('ux_reservations_user_book', 'user_id', 'book_id', unique=True),
+    )
+
+
 class OrderStatusEnum(str, Enum):
     NEW = 'new'
     PAID = 'paid'
@@ -108,6 +140,14 @@ class Order(Base):
     status = Column(SQLAlchemyEnum(OrderStatusEnum), default=OrderStatusEnum.NEW, nullable=False)
     delivery_method = Column(SQLAlchemyEnum(OrderMethodEnum), nullable=False)
     address = Column(String(length=100), nullable=False)
+    # итоги заказа записываются при оформлении, чтобы страницы заказов не читали order_items
+    total_amount = Column(Numeric(precision=10, scale=2), nullable=False, default=0, server_default=text('0'))
+    item_count = Column(Integer, nullable=False, default=0, server_default=text('0'))
+
+    __table_args__ = (
+        # история заказов пользователя: ключ пагинации (created_at, id), статус и итоги берутся прямо из индекса
+        Index('ix_orders_user_history', 'user_id', 'created_at', 'id', 'status', 'item_count', 'total_amount'),
+    )
 
     user = relationship('User', back_populates='orders')
     items = relationship('OrderItem', back_populates='order', cascade='all, delete-orphan', passive_deletes=True)
@@ -122,6 +162,10 @@ class OrderItem(Base):
     quantity = Column(Integer, nullable=False, default=1)
     price = Column(Numeric(precision=10, scale=2), nullable=False)
 
+    __table_args__ = (
+        Index('ix_order_items_order_id', 'order_id'),
+    )
+
     order = relationship('Order', back_populates='items')
     book = relationship('Book', back_populates='in_orders')
 
@@ -137,12 +181,62 @@ class Review(Base):
 
     __table_args__ = (
         CheckConstraint('rating >= 1 AND rating <= 5', name='check_rating_between_1_and_5'),
+        Index('ix_reviews_book_id_id', 'book_id', 'id'),
+        Index('ix_reviews_book_rating_id', 'book_id', 'rating', 'id'),
+        Index('ux_reviews_user_book', 'user_id', 'book_id', unique=True),
     )
 
     user = relationship('User', back_populates='reviews')
     book = relationship('Book', back_populates='reviews')
 
 
+def _review_delta(row, sign):
+    """SET-часть UPDATE books, добавляющая (sign='+') или вычитающая отзыв row (NEW или OLD)"""
+    stars = ', '.join(f'rating_{n} = rating_{n} {sign} ({row}.rating = {n})' for n in range(1, 6))
+    return (f'reviews_count = reviews_count {sign} 1, '
+            f'rating_sum = rating_sum {sign} {row}.rating, '
+            f'{stars}, '
+            f'rating = CASE WHEN reviews_count {sign} 1 > 0 '
+            f'THEN ROUND(CAST(rating_sum {sign} {row}.rating AS REAL) / (reviews_count {sign} 1), 1) '
+            f'ELSE rating END')
+
+
+REVIEW_TRIGGERS = [
+    'CREATE TRIGGER IF NOT EXISTS trg_reviews_insert AFTER INSERT ON reviews BEGIN '
+    f'UPDATE books SET {_review_delta("NEW", "+")} WHERE id = NEW.book_id; END',
+    'CREATE TRIGGER IF NOT EXISTS trg_reviews_delete AFTER DELETE ON reviews BEGIN '
+    f'UPDATE books SET {_review_delta("OLD", "-")} WHERE id = OLD.book_id; END',
+    'CREATE TRIGGER IF NOT EXISTS trg_reviews_update AFTER UPDATE OF rating, book_id ON reviews BEGIN '
+    f'UPDATE books SET {_review_delta("OLD", "-")} WHERE id = OLD.book_id; '
+    f'UPDATE books SET {_review_delta("NEW", "+")} WHERE id = NEW.book_id; END',
+]
+
+ORDER_ITEM_TRIGGERS = [
+    'CREATE TRIGGER IF NOT EXISTS trg_order_items_insert AFTER INSERT ON order_items BEGIN '
+    'UPDATE books SET units_sold = units_sold + NEW.quantity WHERE id = NEW.book_id; END',
+    'CREATE TRIGGER IF NOT EXISTS trg_order_items_delete AFTER DELETE ON order_items BEGIN '
+    'UPDATE books SET units_sold = units_sold - OLD.quantity WHERE id = OLD.book_id; END',
+    'CREATE TRIGGER IF NOT EXISTS trg_order_items_update AFTER UPDATE OF quantity, book_id ON order_items BEGIN '
+    'UPDATE books SET units_sold = units_sold - OLD.quantity WHERE id = OLD.book_id; '
+    'UPDATE books SET units_sold = units_sold + NEW.quantity WHERE id = NEW.book_id; END',
+]
+BOOK_TRIGGERS = [
+    # срабатывает и на обновления из триггеров отзывов (reviews_count, rating_sum)
+    'CREATE TRIGGER IF NOT EXISTS trg_books_version AFTER UPDATE OF quantity, price, reviews_count, rating_sum '
+    'ON books WHEN OLD.quantity IS NOT NEW.quantity OR OLD.price IS NOT NEW.price '
+    'OR OLD.reviews_count IS NOT NEW.reviews_count OR OLD.rating_sum IS NOT NEW.rating_sum BEGIN '
+    'UPDATE books SET version = version + 1 WHERE id = NEW.id; END',
+]
+SCHEMA_TRIGGERS = REVIEW_TRIGGERS + ORDER_ITEM_TRIGGERS + BOOK_TRIGGERS
+
+for _trigger in REVIEW_TRIGGERS:
+    event.listen(Review.__table__, 'after_create', DDL(_trigger).execute_if(dialect='sqlite'))
+for _trigger in ORDER_ITEM_TRIGGERS:
+    event.listen(OrderItem.__table__, 'after_create', DDL(_trigger).execute_if(dialect='sqlite'))
+for _trigger in BOOK_TRIGGERS:
+    event.listen(Book.__table__, 'after_create', DDL(_trigger).execute_if(dialect='sqlite'))
+
+
 class StoreAddress(Base):
     """Адреса магазинов"""
     __tablename__ = 'store_addresses'
@@ -150,12 +244,27 @@ class StoreAddress(Base):
     store_address = Column(String(length=500), nullable=False)
 
 
+class BookSales(Base):
+    """Продажи книг по периодам: неделя (дата понедельника) или всё время"""
+    __tablename__ = 'book_sales'
+    ALL_TIME = 'all'
 
+    book_id = Column(Integer, ForeignKey('books.id', ondelete='CASCADE'), primary_key=True)
+    period = Column(String(length=10), primary_key=True)
+    genre = Column(String(length=80), nullable=False)
+    units_sold = Column(Integer, nullable=False, default=0)
+    revenue = Column(Numeric(precision=12, scale=2), nullable=False, default=0)
 
+    __table_args__ = (
+        Index('ix_book_sales_period_units', 'period', 'units_sold'),
+        Index('ix_book_sales_period_genre_units', 'period', 'genre', 'units_sold'),
+    )
 
+    book = relationship('Book')
 
 
-
-
-
-
+class CatalogState(Base):
+    """Версия каталога, по которой процессы обновляют снимок каталога в памяти"""
+    __tablename__ = 'catalog_state'
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,155 @@
+import contextvars
+import logging
+import sys
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+SERVICES_FILE = str(Path(__file__).with_name('services.py'))
+_current = contextvars.ContextVar('lazy_load_tracker', default=None)
+_qualnames = {}
+
+
+class LazyLoadTracker:
+    """Ленивые загрузки связей и SQL-запросы, выполненные внутри одного отслеживаемого участка.
+
+    Вложенный трекер (например, запроса внутри query_budget теста) передает все, что записал,
+    и внешнему трекеру parent.
+    """
+
+    def __init__(self, threshold=None, parent=None):
+        self.threshold = settings.NPLUSONE_THRESHOLD if threshold is None else threshold
+        self.parent = parent
+        self.lazy_loads = Counter()
+        self.statements = []
+
+    @property
+    def query_count(self):
+        return len(self.statements)
+
+    def record_lazy_load(self, attribute, origin):
+        self.lazy_loads[(attribute, origin)] += 1
+        if self.parent is not None:
+            self.parent.record_lazy_load(attribute, origin)
+
+    def record_statement(self, statement):
+        self.statements.append(statement)
+        if self.parent is not None:
+            self.parent.record_statement(statement)
+
+    def suspects(self):
+        """Связи, лениво загруженные из одного места не меньше threshold раз, — признак N+1"""
+        return [(attribute, origin, count)
+                for (attribute, origin), count in self.lazy_loads.most_common()
+                if count >= self.threshold]
+
+    def report(self):
+        lines = [f'SQL-запросов: {self.query_count}']
+        for (attribute, origin), count in self.lazy_loads.most_common():
+            mark = ' (N+1)' if count >= self.threshold else ''
+            lines.append(f'  {attribute} из {origin}: {count} ленивых загрузок{mark}')
+        return '\n'.join(lines)
+
+
+def _code_qualname(code):
+    """Имя метода сервиса по объекту кода (co_qualname есть только с Python 3.11)"""
+    qualname = getattr(code, 'co_qualname', None)
+    if qualname:
+        return qualname
+    if code not in _qualnames:
+        from app import services
+        _qualnames[code] = code.co_name
+        for service_class in vars(services).values():
+            if isinstance(service_class, type) and service_class.__module__ == services.__name__:
+                for name, attribute in vars(service_class).items():
+                    func = getattr(attribute, '__func__', attribute)
+                    func = getattr(func, '__wrapped__', func)
+                    if getattr(func, '__code__', None) is code:
+                        _qualnames[code] = f'{service_class.__name__}.{name}'
+    return _qualnames[code]
+
+
+def _origin():
+    """Ближайший по стеку метод сервисного слоя, вызвавший загрузку"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_code.co_filename == SERVICES_FILE:
+            return _code_qualname(frame.f_code)
+        frame = frame.f_back
+    return 'вне сервисов'
+
+
+def _on_orm_execute(orm_execute_state):
+    tracker = _current.get()
+    if tracker is None or not orm_execute_state.is_relationship_load:
+        return
+    parent = orm_execute_state.lazy_loaded_from
+    path = orm_execute_state.loader_strategy_path
+    if parent is None or path is None:
+        return
+    tracker.record_lazy_load(f'{parent.mapper.class_.__name__}.{path[-1].key}', _origin())
+
+
+def _on_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    tracker = _current.get()
+    if tracker is not None:
+        tracker.record_statement(statement)
+
+
+_installed_engines = set()
+
+
+def install(engine):
+    """Подключает слушатели к сессиям и движку; без активного трекера они ничего не делают"""
+    if not event.contains(Session, 'do_orm_execute', _on_orm_execute):
+        event.listen(Session, 'do_orm_execute', _on_orm_execute)
+    if id(engine) not in _installed_engines:
+        event.listen(engine, 'before_cursor_execute', _on_cursor_execute)
+        _installed_engines.add(id(engine))
+
+
+@contextmanager
+def track(engine, threshold=None):
+    """Отслеживает ленивые загрузки и запросы внутри блока with"""
+    install(engine)
+    tracker = LazyLoadTracker(threshold, parent=_current.get())
+    token = _current.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _current.reset(token)
+
+
+def init_app(app):
+    """Включает обнаружение N+1 на каждый запрос (NPLUSONE_DETECT), например на стенде и в тестах"""
+    if not settings.NPLUSONE_DETECT:
+        return
+    from app import database
+    database.on_engine_created(install)
+
+    @app.before_request
+    def start_tracking():
+        # трекер, уже открытый вокруг запроса (query_budget в тестах), продолжает получать все загрузки и запросы
+        tracker = LazyLoadTracker(parent=_current.get())
+        g.nplusone_tracker = (tracker, _current.set(tracker))
+
+    @app.teardown_request
+    def finish_tracking(exc):
+        tracker, token = g.pop('nplusone_tracker', (None, None))
+        if tracker is None:
+            return
+        try:
+            _current.reset(token)
+        except ValueError:
+            _current.set(None)
+        for attribute, origin, count in tracker.suspects():
+            logger.warning('N+1 в %s %s: %s загружается лениво %d раз из %s',
+                           request.method, request.path, attribute, count, origin)
+        if tracker.lazy_loads:
+            logger.debug('Ленивые загрузки %s %s:\n%s', request.method, request.path, tracker.report())
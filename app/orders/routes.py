@@ -2,7 +2,7 @@ from flask import Blueprint, flash, redirect, render_template, url_for, request,
 from flask_login import current_user, login_required
 from app.services import CartService
 from app.services import OrderService
-from app.exceptions import DatabaseOperationError, DataAccessError, ServiceError
+from app.exceptions import DatabaseOperationError, DataAccessError, ServiceError, OutOfStockError
 from app.orders.forms import CodeForm, CardDetailsForm
 from random import randint
 
@@ -19,7 +19,8 @@ def new_order(user_id):
             return redirect(url_for('books.home'))
 
         try:
-            available_items = CartService.get_available_items_from_cart(user_id)
+            cart_view = CartService.get_cart_view(user_id)
+            available_items = cart_view['available']
         except Exception as e:
             print(f'Произошла ошибка: {e}')
             flash('Ошибка получения корзины', 'error')
@@ -74,19 +75,16 @@ def new_order(user_id):
 
                     full_address = ', '.join(filter(None, address_parts)).lower()
 
-                    OrderService.create_order(user_id, full_address, delivery_method)
-
-                    last_order = OrderService.get_last_order(user_id)
-
-                    for item in available_items:
-                        OrderService.create_order_item(last_order['id'], item['book_id'], item['quantity'], item['price'], user_id)
-                        OrderService.delete_cart_item(item['id'])
+                    order_id = OrderService.place_order(user_id, full_address, delivery_method)
 
                     return redirect(url_for('orders.order_payment',
                                             user_id=user_id,
-                                            order_id=last_order['id'],
+                                            order_id=order_id,
                                             step='card_details'))
 
+                except OutOfStockError as e:
+                    flash(str(e), 'error')
+                    return redirect(url_for('cart.cart', user_id=user_id))
                 except (DatabaseOperationError, DataAccessError, ServiceError) as e:
                     flash('Ошибка при создании заказа', 'error')
                     return redirect(url_for('orders.new_order', user_id=user_id))
@@ -98,15 +96,13 @@ def new_order(user_id):
                 try:
                     delivery_method = 'PICKUP'
                     full_address = request.form.get('store_address', '')
-                    OrderService.create_order(user_id, full_address, delivery_method)
-                    last_order = OrderService.get_last_order(user_id)
-
-                    for item in available_items:
-                        OrderService.create_order_item(last_order['id'], item['book_id'], item['quantity'], item['price'], user_id)
-                        OrderService.delete_cart_item(item['id'])
+                    order_id = OrderService.place_order(user_id, full_address, delivery_method)
 
-                    return redirect(url_for('orders.order_payment', user_id=user_id, order_id=last_order['id'], step='card_details'))
+                    return redirect(url_for('orders.order_payment', user_id=user_id, order_id=order_id, step='card_details'))
 
+                except OutOfStockError as e:
+                    flash(str(e), 'error')
+                    return redirect(url_for('cart.cart', user_id=user_id))
                 except (DatabaseOperationError, DataAccessError, ServiceError) as e:
                     flash('Ошибка при создании заказа', 'error')
                     return redirect(url_for('orders.new_order', user_id=user_id))
@@ -176,12 +172,11 @@ def order_payment(user_id, order_id, step):
                                             order_id=order_id,
                                             step='code'))
         try:
-            order_items = OrderService.get_order_items_in_order(order_id)
-            total_price = sum([order_item['price'] for order_item in order_items])
+            order = OrderService.get_order_by_id(order_id)
             return render_template('orders/order-payment.html',
                                    user_id=user_id,
                                    order_id=order_id,
-                                   total_price=total_price,
+                                   total_price=order['total_amount'],
                                    step=step,
                                    form=form)
         except (DatabaseOperationError, DataAccessError, ServiceError) as e:
@@ -213,8 +208,6 @@ def order_info(user_id, order_id):
                 return redirect(url_for('books.home'))
 
             order_items = OrderService.get_order_items_in_order(order_id)
-            order['created_at'] = OrderService.time_to_string(order['created_at'])
-            order['updated_at'] = OrderService.time_to_string(order['updated_at'])
 
             return render_template('orders/order-info.html',
                                    user_id=user_id,
@@ -248,18 +241,19 @@ def order_history(user_id):
             return redirect(url_for('books.home'))
 
         try:
-            users_orders = OrderService.users_orders_to_dict(user_id)
-            for order in users_orders:
-                order['created_at'] = OrderService.time_to_string(order['created_at'])
-                order['updated_at'] = OrderService.time_to_string(order['updated_at'])
+            history = OrderService.get_order_history(user_id, cursor=request.args.get('cursor'))
 
             return render_template('orders/order-history.html',
                                    user_id=user_id,
-                                   users_orders=users_orders)
+                                   users_orders=history['orders'],
+                                   next_cursor=history['next_cursor'])
 
         except (DatabaseOperationError, DataAccessError, ServiceError) as e:
             flash('Ошибка при получении истории заказов', 'error')
             return redirect(url_for('books.home'))
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('orders.order_history', user_id=user_id))
         except Exception as e:
             print(f"Неожиданная ошибка: {e}")
             flash('Внутренняя ошибка сервера', 'error')
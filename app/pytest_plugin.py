@@ -0,0 +1,34 @@
+"""Фикстуры pytest для контроля числа SQL-запросов.
+
+Подключение в conftest.py:
+    pytest_plugins = ['app.pytest_plugin']
+
+Пример:
+    def test_catalog(client, query_budget):
+        with query_budget(3):
+            client.get('/catalog')
+"""
+from contextlib import contextmanager
+import pytest
+from app import nplusone
+from app.database import get_engine
+
+
+@pytest.fixture
+def query_budget():
+    """Проваливает тест, если блок выполнил больше запросов, чем заявлено, или содержит N+1"""
+
+    @contextmanager
+    def budget(max_queries, allow_nplusone=False, threshold=None):
+        with nplusone.track(get_engine(), threshold) as tracker:
+            yield tracker
+        problems = []
+        if tracker.query_count > max_queries:
+            problems.append(f'выполнено {tracker.query_count} SQL-запросов при бюджете {max_queries}')
+        if tracker.suspects() and not allow_nplusone:
+            problems.append('обнаружены N+1 загрузки')
+        if problems:
+            statements = '\n'.join(f'  {statement}' for statement in tracker.statements)
+            pytest.fail(f'{"; ".join(problems)}\n{tracker.report()}\nЗапросы:\n{statements}', pytrace=False)
+
+    return budget
@@ -0,0 +1,54 @@
+import logging
+import os
+import threading
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ReservationSweeper:
+    """Фоновый поток процесса, удаляющий истекшие резервы раз в RESERVATION_SWEEP_INTERVAL секунд"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """Запускает поток, если он еще не работает в текущем процессе (потоки не переживают fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            if settings.RESERVATION_SWEEP_INTERVAL <= 0:
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='reservation-sweeper', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        from app.services import ReservationService
+        while not self._stop.wait(settings.RESERVATION_SWEEP_INTERVAL):
+            try:
+                removed = ReservationService.sweep_expired()
+                if removed:
+                    logger.info('Снято истекших резервов: %s', removed)
+            except Exception as e:
+                logger.warning('Ошибка очистки резервов: %s', e)
+
+
+sweeper = ReservationSweeper()
+
+
+def init_app(app):
+    """Запускает очистку резервов при первом запросе процесса — в том числе в каждом воркере после fork"""
+
+    @app.before_request
+    def start_reservation_sweeper():
+        sweeper.start()
@@ -0,0 +1,86 @@
+import re
+from bisect import bisect_left
+from math import ceil
+
+
+TOKEN_RE = re.compile(r'\w+')
+FIELD_WEIGHTS = {
+    'title': 3.0,
+    'author': 2.0,
+    'genre': 1.0,
+    'description': 0.5
+}
+EXACT_TERM_BONUS = 1.5
+DEFAULT_PAGE_SIZE = 24
+
+
+def tokenize(text):
+    """Разбивает текст на нормализованные слова, спецсимволы запроса не интерпретируются"""
+    if not text:
+        return []
+    return TOKEN_RE.findall(text.lower().replace('ё', 'е'))
+
+
+class SearchIndex:
+    """Инвертированный индекс книг по названию, автору, жанру и описанию"""
+
+    def __init__(self, documents):
+        postings = {}
+        docs = {}
+        for doc in documents:
+            docs[doc['id']] = doc
+            for field, weight in FIELD_WEIGHTS.items():
+                for term in tokenize(doc.get(field)):
+                    term_postings = postings.setdefault(term, {})
+                    term_postings[doc['id']] = term_postings.get(doc['id'], 0) + weight
+        self._postings = postings
+        self._terms = sorted(postings)
+        self._docs = docs
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _expand(self, prefix):
+        """Все термины словаря, начинающиеся с prefix"""
+        position = bisect_left(self._terms, prefix)
+        while position < len(self._terms) and self._terms[position].startswith(prefix):
+            yield self._terms[position]
+            position += 1
+
+    def _score_term(self, term):
+        scores = {}
+        for full_term in self._expand(term):
+            bonus = EXACT_TERM_BONUS if full_term == term else 1.0
+            for doc_id, weight in self._postings[full_term].items():
+                score = weight * bonus
+                if score > scores.get(doc_id, 0):
+                    scores[doc_id] = score
+        return scores
+
+    def search(self, query, page=1, per_page=DEFAULT_PAGE_SIZE):
+        """Ищет книги, содержащие все слова запроса (по префиксу), и возвращает страницу результатов"""
+        page = max(page, 1)
+        scores = None
+        for term in dict.fromkeys(tokenize(query)):
+            term_scores = self._score_term(term)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {doc_id: score + term_scores[doc_id]
+                          for doc_id, score in scores.items() if doc_id in term_scores}
+            if not scores:
+                break
+
+        scores = scores or {}
+        ranked = sorted(
+            scores,
+            key=lambda doc_id: (-scores[doc_id], -float(self._docs[doc_id]['rating'] or 0), doc_id)
+        )
+        offset = (page - 1) * per_page
+        return {
+            'items': [self._docs[doc_id] for doc_id in ranked[offset:offset + per_page]],
+            'total': len(ranked),
+            'page': page,
+            'pages': ceil(len(ranked) / per_page) if ranked else 0
+        }
+
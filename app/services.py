@@ -5,14 +5,24 @@ from app.exceptions import (DatabaseOperationError,
                             ServiceError,
                             BooksNotFoundError,
                             BookNotFoundError,
-                            ReviewExistsError)
-from app.models import User, Book, Review, CartItem, OrderItem, Order, StoreAddress, OrderStatusEnum
-from app.database import session_scope
+                            ReviewExistsError,
+                            OutOfStockError)
+from app.models import (User, Book, Review, CartItem, OrderItem, Order, StoreAddress, OrderStatusEnum, BookSales,
+                        Reservation)
+from app.database import session_scope, transaction
+from app import catalog, search
+from app.config import settings
+from app.auth.identity import user_cache
 from sqlalchemy.exc import SQLAlchemyError, DatabaseError
-import re
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 from collections import defaultdict
+from sqlalchemy import (select, insert, update, delete, func, literal, tuple_, case, Float, String, DateTime,
+                        type_coerce)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import joinedload
+from decimal import Decimal
+
+REVIEW_SORTS = ('newest', 'rating')
 
 
 class AuthService:
@@ -65,7 +75,7 @@ class AuthService:
     def add_user(name, surname, email, phone, password):
         """Добавляет пользователя в модель User"""
         try:
-            with session_scope() as db_session:
+            with transaction() as db_session:
                 user = User(name=name,
                             surname=surname,
                             email=email,
@@ -83,9 +93,10 @@ class AuthService:
     def update_password(user_id, new_password):
         """Обновление пароля"""
         try:
-            with session_scope() as db_session:
+            with transaction() as db_session:
                 user = db_session.query(User).get(user_id)
                 user.password_hash = generate_password_hash(new_password)
+            user_cache.invalidate(user_id)
         except DatabaseError as db_error:
             raise DatabaseOperationError("Ошибка при работе с базой данных") from db_error
         except SQLAlchemyError as sql_error:
@@ -96,125 +107,135 @@ class AuthService:
 
 class BookService:
     @staticmethod
-    def book_to_dict(book):
-        """Получает книгу по объекту из БД"""
-        if not book:
-            raise ValueError('Книга не найдена')
-        try:
-            quantity_in_orders = sum(item.quantity for item in book.in_orders) if hasattr(book, 'in_orders') else 0
-            return {
-                'id': book.id,
-                'title': book.title,
-                'author': book.author,
-                'price': book.price,
-                'genre': book.genre,
-                'cover': book.cover,
-                'description': book.description,
-                'pages': book.pages,
-                'rating': book.rating,
-                'year': book.year,
-                'quantity': book.quantity,
-                'quantity_in_orders': quantity_in_orders
-            }
-        except AttributeError as e:
-            raise ValueError(f'Некорректный объект книги: {e}') from e
-        except TypeError as e:
-            raise ValueError(f'Ошибка в данных книги: {e}') from e
-
-    @staticmethod
-    def review_to_dict(review):
-        """Преобразование отзыва в словарь"""
-        if not review:
-            raise ValueError('Отзыв не найден')
-        try:
-            return {
-                'id': review.id,
-                'review': review.review,
-                'user_id': review.user_id,
-                'book_id': review.book_id,
-                'rating': review.rating,
-                'user': f'{review.user.name} {review.user.surname[0]}.',
-                'books': review.book.title
-            }
-        except AttributeError as e:
-            raise ValueError(f'Некорректный объект отзыва: {str(e)}')
-
-    @staticmethod
-    def get_all_books():
-        """Получает все книги из БД в виде списка со словарями"""
+    def get_catalog_version():
+        """Версия данных каталога для ключей кэша фрагментов"""
+        return catalog.get_snapshot().version
+
+    @staticmethod
+    def get_catalog_overview(sort='rating', limit=None):
+        """Жанры каталога с количеством книг и первой страницей книг каждого жанра"""
+        limit = limit or settings.CATALOG_PAGE_SIZE
+        snapshot = catalog.get_snapshot()
+        if not snapshot.books:
+            raise BooksNotFoundError('Книги не найдены')
+        return [
+            {'genre': genre,
+             'count': count,
+             **snapshot.genre_page(genre, sort, limit=limit)}
+            for genre, count in sorted(snapshot.genre_counts.items())
+        ]
+
+    @staticmethod
+    def get_genre_page(genre, sort='rating', cursor=None, limit=None):
+        """Страница книг жанра с курсорной пагинацией"""
+        if sort not in catalog.SORT_KEYS:
+            raise ValueError(f'Неизвестная сортировка: {sort}')
+        limit = limit or settings.CATALOG_PAGE_SIZE
+        snapshot = catalog.get_snapshot()
+        if genre not in snapshot.genre_counts:
+            raise BooksNotFoundError(f'Книги жанра {genre} не найдены')
+        return {'genre': genre,
+                'sort': sort,
+                'count': snapshot.genre_counts[genre],
+                **snapshot.genre_page(genre, sort, cursor=cursor, limit=limit)}
+
+    @staticmethod
+    def _parse_id(book_id):
+        try:
+            return int(book_id)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _parse_reviews_cursor(sort, cursor):
+        if sort not in REVIEW_SORTS:
+            raise ValueError(f'Неизвестная сортировка отзывов: {sort}')
+        return catalog.decode_cursor(cursor, sort, size=2 if sort == 'rating' else 1) if cursor else None
+
+    @staticmethod
+    def _query_reviews(db_session, book_id, sort, after, limit):
+        """Отзывы страницы одним запросом с именем автора; на одну строку больше limit для курсора"""
+        query = (
+            db_session.query(Review.id, Review.review, Review.rating, User.name, User.surname)
+            .outerjoin(User, User.id == Review.user_id)
+            .filter(Review.book_id == book_id)
+        )
+        if sort == 'rating':
+            if after:
+                query = query.filter(tuple_(Review.rating, Review.id) < tuple_(*after))
+            query = query.order_by(Review.rating.desc(), Review.id.desc())
+        else:
+            if after:
+                query = query.filter(Review.id < after[0])
+            query = query.order_by(Review.id.desc())
+        return query.limit(limit + 1).all()
+
+    @staticmethod
+    def _reviews_page(rows, sort, limit, stars):
+        page = rows[:limit]
+        next_cursor = None
+        if len(rows) > limit:
+            last = page[-1]
+            next_cursor = catalog.encode_cursor((last.rating, last.id) if sort == 'rating' else (last.id,), sort)
+        histogram = dict(zip(range(5, 0, -1), stars))
+        return {
+            'sort': sort,
+            'reviews': [{'id': row.id,
+                         'review': row.review,
+                         'rating': row.rating,
+                         'user': f'{row.name} {row.surname[0]}.' if row.name else 'Пользователь удалён'}
+                        for row in page],
+            'next_cursor': next_cursor,
+            'count': sum(histogram.values()),
+            'histogram': histogram
+        }
+
+    @staticmethod
+    def get_book_validators(book_id, user_id=None):
+        """Версия и доступный пользователю остаток книги для условных GET-запросов,
+        вызывает BookNotFound если не найдена"""
+        # резервы меняют доступный остаток, не меняя версию книги, поэтому он тоже входит в валидаторы
+        available = Book.quantity - ReservationService.reserved_by_others(Book.id, user_id, ReservationService.now())
         try:
             with session_scope() as db_session:
-                all_books = db_session.query(Book).all()
-                if not all_books:
-                    raise BooksNotFoundError('Книги не найдены')
-                return [BookService.book_to_dict(book) for book in all_books]
-
+                row = (
+                    db_session.query(Book.version, available.label('store_quantity'))
+                    .filter(Book.id == BookService._parse_id(book_id))
+                    .first()
+                )
         except DatabaseError as db_error:
-                raise DatabaseOperationError('Ошибка при работе с базой данных') from db_error
+            raise DatabaseOperationError('Ошибка при работе с базой данных') from db_error
         except SQLAlchemyError as sql_error:
             raise DataAccessError('Ошибка доступа к данным') from sql_error
-        except Exception as error:
-            raise ServiceError('Внутренняя ошибка сервиса книг') from error
+        if row is None:
+            raise BookNotFoundError(f'Книга с id {book_id} не найдена')
+        return row.version, max(row.store_quantity, 0)
 
     @staticmethod
-    def get_book_by_id(book_id):
-        """Получает книгу по ID в виде словаря, вызывает BookNotFound если не найдена"""
+    def get_book_page(book_id, user_id=None, reviews_sort='newest', reviews_cursor=None, limit=None):
+        """Книга с остатком, сводкой оценок и первой страницей отзывов в одной сессии"""
+        after = BookService._parse_reviews_cursor(reviews_sort, reviews_cursor)
+        limit = limit or settings.REVIEWS_PAGE_SIZE
+        book_id = BookService._parse_id(book_id)
+        # book_quantity — сколько экземпляров доступно пользователю, как store_quantity в корзине
+        available = Book.quantity - ReservationService.reserved_by_others(Book.id, user_id, ReservationService.now())
         try:
             with session_scope() as db_session:
-                book = db_session.query(Book).get(book_id)
-                if not book:
+                book = (
+                    db_session.query(Book.id, Book.title, Book.author, Book.price, Book.genre, Book.cover,
+                                     Book.description, Book.pages, Book.rating, Book.year, Book.quantity,
+                                     available.label('store_quantity'),
+                                     Book.reviews_count, Book.version,
+                                     Book.rating_5, Book.rating_4, Book.rating_3, Book.rating_2, Book.rating_1)
+                    .filter(Book.id == book_id)
+                    .first()
+                )
+                if book is None:
                     raise BookNotFoundError(f'Книга с id {book_id} не найдена')
-                return BookService.book_to_dict(book)
-        except DatabaseError as db_error:
-                raise DatabaseOperationError('Ошибка при работе с базой данных') from db_error
-        except SQLAlchemyError as sql_error:
-            raise DataAccessError('Ошибка доступа к данным') from sql_error
-        except Exception as error:
-            raise ServiceError('Внутренняя ошибка сервиса книг') from error
-
-    @staticmethod
-    def get_books_by_genre():
-        """Получение всех книг по жанру в виде словаря"""
-        books = BookService.get_all_books()
-        books_by_genre = dict()
-        for book in books:
-            book_info = {
-                'id': book['id'],
-                'title': book['title'],
-                'author': book['author'],
-                'cover': book['cover'],
-                'rating': book['rating']
-            }
-            if book['genre'] not in books_by_genre:
-                books_by_genre[book['genre']] = []
-            books_by_genre[book['genre']].append(book_info)
-        return books_by_genre
-
-    @staticmethod
-    def check_book_quantity(book_id):
-        """Проверяет количество доступных экземпляров книг в БД"""
-        try:
-            with session_scope() as db_session:
-                book = db_session.query(Book).get(book_id)
-                if not book:
-                    return None
-                return book.quantity
-        except DatabaseError as db_error:
-                raise DatabaseOperationError('Ошибка при работе с базой данных') from db_error
-        except SQLAlchemyError as sql_error:
-            raise DataAccessError('Ошибка доступа к данным') from sql_error
-        except Exception as error:
-            raise ServiceError('Внутренняя ошибка сервиса книг') from error
-
-    @staticmethod
-    def get_reviews_by_book_id(book_id):
-        """Получает все отзывы о книге по id книги в виде словаря"""
-        try:
-            with session_scope() as db_session:
-                reviews = db_session.query(Review).filter_by(book_id=book_id).all()
-                if not reviews:
-                    return []
-                return [BookService.review_to_dict(review) for review in reviews]
+                rows = BookService._query_reviews(db_session, book_id, reviews_sort, after, limit) \
+                    if book.reviews_count else []
+        except BookNotFoundError:
+            raise
         except DatabaseError as db_error:
             raise DatabaseOperationError('Ошибка при работе с базой данных') from db_error
         except SQLAlchemyError as sql_error:
@@ -222,24 +243,36 @@ class BookService:
         except Exception as error:
             raise ServiceError('Внутренняя ошибка сервиса книг') from error
 
+        stars = (book.rating_5, book.rating_4, book.rating_3, book.rating_2, book.rating_1)
+        return {
+            'book': {field: getattr(book, field) for field in (
+                'id', 'title', 'author', 'price', 'genre', 'cover', 'description', 'pages', 'rating', 'year', 'quantity'
+            )},
+            'book_quantity': max(book.store_quantity, 0),
+            'reviews': BookService._reviews_page(rows, reviews_sort, limit, stars),
+            'version': book.version
+        }
+
     @staticmethod
     def add_review(review_text, user_id, book_id, rating):
-        """Добавление отзыва в БД"""
-        try:
-            with session_scope() as db_session:
-                book = db_session.query(Book).get(book_id)
-                if not book:
-                    raise BookNotFoundError(f'Книга с id {book_id} не найдена')
-                review = db_session.query(Review).filter_by(user_id=user_id, book_id=book_id).first()
-                if review:
+        """Добавление отзыва в БД; рейтинг и агрегаты книги обновляют триггеры в том же запросе"""
+        try:
+            with transaction() as db_session:
+                # повторный отзыв отсекает уникальный индекс (user_id, book_id): строка просто не вставляется
+                inserted = db_session.execute(
+                    sqlite_insert(Review).from_select(
+                        ['review', 'user_id', 'book_id', 'rating'],
+                        select(literal(review_text), literal(user_id), Book.id, literal(rating))
+                        .where(Book.id == book_id)
+                    ).on_conflict_do_nothing(index_elements=[Review.user_id, Review.book_id])
+                )
+                if not inserted.rowcount:
+                    if db_session.query(Book.id).filter(Book.id == book_id).scalar() is None:
+                        raise BookNotFoundError(f'Книга с id {book_id} не найдена')
                     raise ReviewExistsError('Вы уже оценили эту книгу')
-                new_review = Review(review=review_text,
-                                    user_id=user_id,
-                                    book_id=book_id,
-                                    rating=rating)
-                db_session.add(new_review)
-                book.update_rating()
-                return new_review
+                catalog.bump_version(db_session)
+        except (BookNotFoundError, ReviewExistsError):
+            raise
         except DatabaseError as db_error:
                 raise DatabaseOperationError('Ошибка при работе с базой данных') from db_error
         except SQLAlchemyError as sql_error:
@@ -251,24 +284,26 @@ class BookService:
     def update_cart(user_id, book_id):
         """Добавление книги в корзину"""
         try:
-            with session_scope() as db_session:
+            with transaction() as db_session:
                 book = db_session.query(Book).get(book_id)
                 if not book:
                     raise BookNotFoundError(f'Книга с id {book_id} не найдена')
 
                 cart_item = db_session.query(CartItem).filter_by(user_id=user_id, book_id=book_id).first()
+                quantity = cart_item.quantity + 1 if cart_item else 1
+                if not ReservationService.reserve(db_session, user_id, book_id, quantity):
+                    raise OutOfStockError(f'Свободных экземпляров книги "{book.title}" больше нет')
                 if cart_item:
-                    if cart_item.book.quantity >= cart_item.quantity + 1:
-                        cart_item.quantity += 1
-                        return cart_item
-                    else:
-                        raise ValueError('Нельзя повторно добавить в корзину этот товар')
+                    cart_item.quantity = quantity
+                    return cart_item
 
                 new_cart_item = CartItem(user_id=user_id,
                                          book_id=book_id,
                                          quantity=1)
                 db_session.add(new_cart_item)
             return new_cart_item
+        except OutOfStockError:
+            raise
         except DatabaseError as db_error:
                 raise DatabaseOperationError('Ошибка при работе с базой данных') from db_error
         except SQLAlchemyError as sql_error:
@@ -277,72 +312,183 @@ class BookService:
             raise ServiceError('Внутренняя ошибка сервиса книг') from error
 
     @staticmethod
-    def search_book(user_query):
-        """Поиск книги"""
+    def warm_catalog():
+        """Строит снимок каталога и поисковый индекс заранее, до первого запроса"""
+        snapshot = catalog.get_snapshot()
+        return snapshot.search_index
+
+    @staticmethod
+    def search_book(user_query, page=1, per_page=search.DEFAULT_PAGE_SIZE):
+        """Поиск книги по индексу, возвращает страницу результатов"""
         if not user_query or len(user_query.strip()) < 2:
             raise ValueError('Слишком короткий поисковый запрос')
-        user_query = user_query.lower().strip()
         try:
-            all_books = BookService.get_all_books()
-            if not all_books:
-                return []
-            result = []
-            for book in all_books:
-                regex_title = re.search(user_query, book['title'].lower())
-                regex_author = re.search(user_query, book['author'].lower())
-                if (regex_title or regex_author) and book not in result:
-                    result.append(book)
-            return result
+            index = catalog.get_snapshot().search_index
+            return index.search(user_query, page=page, per_page=per_page)
         except Exception as e:
-            print(f'Произошла ошибка: {e}')
             raise ServiceError(f'Ошибка поиска: {str(e)}') from e
 
     @staticmethod
-    def get_top_books():
-        """Получение ТОП-3 книг прошедшей недели"""
-        today = datetime.now()
-        last_week_monday = today - timedelta(days=today.weekday() + 7)
-        last_week_monday = last_week_monday.replace(hour=0, minute=0, second=0, microsecond=0)
-        last_week_sunday = last_week_monday + timedelta(days=6, hours=23, minutes=59, seconds=59)
+    def week_period(moment):
+        """Ключ недельного периода продаж: дата понедельника в формате ГГГГ-ММ-ДД по дате moment без перевода в UTC"""
+        day = moment.date() if isinstance(moment, datetime) else moment
+        return (day - timedelta(days=day.weekday())).isoformat()
+
+    @staticmethod
+    def record_sales(db_session, lines, sold_at):
+        """Увеличивает агрегаты продаж по строкам заказа вида (book_id, genre, quantity, price)"""
+        period = BookService.week_period(sold_at)
+        rows = []
+        for book_id, genre, quantity, price in lines:
+            revenue = Decimal(str(price)) * quantity
+            for bucket in (period, BookSales.ALL_TIME):
+                rows.append({'book_id': book_id,
+                             'period': bucket,
+                             'genre': genre,
+                             'units_sold': quantity,
+                             'revenue': revenue})
+        if not rows:
+            return
+        statement = sqlite_insert(BookSales).values(rows)
+        db_session.execute(statement.on_conflict_do_update(
+            index_elements=[BookSales.book_id, BookSales.period],
+            set_={'units_sold': BookSales.units_sold + statement.excluded.units_sold,
+                  'revenue': BookSales.revenue + statement.excluded.revenue,
+                  'genre': statement.excluded.genre}
+        ))
+
+    @staticmethod
+    def rebuild_sales_stats():
+        """Пересчитывает агрегаты продаж по всей истории заказов"""
+        try:
+            with transaction() as db_session:
+                db_session.query(BookSales).delete()
+                line_units = func.sum(OrderItem.quantity)
+                line_revenue = func.sum(OrderItem.quantity * OrderItem.price)
+                # недели размечает та же week_period, что и record_sales при оформлении заказа:
+                # по дате created_at в том виде, в каком она записана, а не по date() SQLite в UTC
+                order_day = func.substr(type_coerce(Order.created_at, String), 1, 10)
+                daily = (
+                    db_session.query(OrderItem.book_id,
+                                     Book.genre,
+                                     order_day.label('day'),
+                                     line_units.label('units_sold'),
+                                     line_revenue.label('revenue'))
+                    .join(Order, Order.id == OrderItem.order_id)
+                    .join(Book, Book.id == OrderItem.book_id)
+                    .group_by(OrderItem.book_id, order_day)
+                )
+                weekly = {}
+                for row in daily:
+                    period = BookService.week_period(date.fromisoformat(row.day))
+                    sales = weekly.setdefault((row.book_id, period), {'book_id': row.book_id,
+                                                                      'period': period,
+                                                                      'genre': row.genre,
+                                                                      'units_sold': 0,
+                                                                      'revenue': Decimal(0)})
+                    sales['units_sold'] += row.units_sold
+                    sales['revenue'] += Decimal(str(row.revenue))
+                all_time = (
+                    select(OrderItem.book_id,
+                           literal(BookSales.ALL_TIME),
+                           Book.genre,
+                           line_units,
+                           line_revenue)
+                    .join(Book, Book.id == OrderItem.book_id)
+                    .group_by(OrderItem.book_id)
+                )
+                columns = ['book_id', 'period', 'genre', 'units_sold', 'revenue']
+                if weekly:
+                    db_session.execute(insert(BookSales), list(weekly.values()))
+                db_session.execute(insert(BookSales).from_select(columns, all_time))
+                return db_session.query(BookSales).filter_by(period=BookSales.ALL_TIME).count()
+        except DatabaseError as db_error:
+            raise DatabaseOperationError('Ошибка при работе с базой данных') from db_error
+        except SQLAlchemyError as sql_error:
+            raise DataAccessError('Ошибка доступа к данным') from sql_error
 
+    @staticmethod
+    def rebuild_rating_stats():
+        """Пересчитывает агрегаты отзывов и рейтинг всех книг одним сгруппированным запросом"""
         try:
-            with session_scope() as db_session:
-                orders = (
-                    db_session.query(Order)
-                    .options(joinedload(Order.items).joinedload(OrderItem.book))
-                    .filter(
-                        Order.created_at >= last_week_monday,
-                        Order.created_at <= last_week_sunday
-                    )
-                    .all()
+            with transaction() as db_session:
+                stats = (
+                    select(Review.book_id,
+                           func.count(Review.id).label('reviews_count'),
+                           func.sum(Review.rating).label('rating_sum'),
+                           *(func.sum(case((Review.rating == stars, 1), else_=0)).label(f'rating_{stars}')
+                             for stars in range(1, 6)))
+                    .group_by(Review.book_id)
+                    .subquery()
                 )
-
-                book_stats = defaultdict(
-                    lambda: {
-                        'id': None,
-                        'title': None,
-                        'author': None,
-                        'cover': None,
-                        'quantity': 0
-                    }
+                db_session.execute(
+                    update(Book)
+                    .where(~Book.id.in_(select(Review.book_id)))
+                    .values(reviews_count=0, rating_sum=0, rating_1=0, rating_2=0, rating_3=0, rating_4=0, rating_5=0)
                 )
+                updated = db_session.execute(
+                    update(Book)
+                    .where(Book.id == stats.c.book_id)
+                    .values(reviews_count=stats.c.reviews_count,
+                            rating_sum=stats.c.rating_sum,
+                            rating=func.round(func.cast(stats.c.rating_sum, Float) / stats.c.reviews_count, 1),
+                            **{f'rating_{stars}': stats.c[f'rating_{stars}'] for stars in range(1, 6)})
+                ).rowcount
+                catalog.bump_version(db_session)
+                return updated
+        except DatabaseError as db_error:
+            raise DatabaseOperationError('Ошибка при работе с базой данных') from db_error
+        except SQLAlchemyError as sql_error:
+            raise DataAccessError('Ошибка доступа к данным') from sql_error
 
-                for order in orders:
-                    for item in order.items:
-                        book = item.book
-                        book_stats[book.id]['id'] = book.id
-                        book_stats[book.id]['title'] = book.title
-                        book_stats[book.id]['author'] = book.author
-                        book_stats[book.id]['cover'] = book.cover
-                        book_stats[book.id]['quantity'] = book.quantity
+    @staticmethod
+    def verify_units_sold(fix=False):
+        """Сверяет счетчики проданных экземпляров с позициями заказов, при fix исправляет расхождения"""
+        try:
+            # с fix сверка заканчивается записью, поэтому сразу идет в транзакции записи
+            scope = transaction if fix else session_scope
+            with scope() as db_session:
+                actual = (
+                    select(func.coalesce(func.sum(OrderItem.quantity), 0))
+                    .where(OrderItem.book_id == Book.id)
+                    .scalar_subquery()
+                )
+                drift = (
+                    db_session.query(Book.id, Book.units_sold, actual.label('actual'))
+                    .filter(Book.units_sold != actual)
+                    .order_by(Book.id)
+                    .all()
+                )
+                if fix and drift:
+                    db_session.execute(update(Book).where(Book.units_sold != actual).values(units_sold=actual))
+                    catalog.bump_version(db_session)
+                return [(row.id, row.units_sold, row.actual) for row in drift]
+        except DatabaseError as db_error:
+            raise DatabaseOperationError('Ошибка при работе с базой данных') from db_error
+        except SQLAlchemyError as sql_error:
+            raise DataAccessError('Ошибка доступа к данным') from sql_error
 
-                top_books = sorted(
-                    book_stats.items(),
-                    key=lambda item: item[1]['quantity'],
-                    reverse=True
-                )[:3]
+    @staticmethod
+    def get_top_books(limit=3):
+        """Получение ТОП-3 книг прошедшей недели по количеству проданных экземпляров"""
+        today = datetime.now()
+        last_week = BookService.week_period(today - timedelta(days=7))
 
-                return top_books
+        try:
+            with session_scope() as db_session:
+                rows = (
+                    db_session.query(Book.id, Book.title, Book.author, Book.cover, BookSales.units_sold)
+                    .join(BookSales, BookSales.book_id == Book.id)
+                    .filter(BookSales.period == last_week)
+                    .order_by(BookSales.units_sold.desc(), Book.id)
+                    .limit(limit)
+                    .all()
+                )
+                return [(row.id, {'id': row.id,
+                                  'title': row.title,
+                                  'author': row.author,
+                                  'cover': row.cover,
+                                  'quantity': row.units_sold}) for row in rows]
 
         except DatabaseError as db_error:
                 raise DatabaseOperationError('Ошибка при работе с базой данных') from db_error
@@ -352,41 +498,39 @@ class BookService:
             raise ServiceError('Внутренняя ошибка сервиса книг') from error
 
     @staticmethod
-    def get_top_books_by_genre():
-        """Получение топ-книг по жанру"""
+    def get_top_books_by_genre(limit=3):
+        """Получение топ-книг по жанру за всё время"""
         try:
             with session_scope() as db_session:
-                orders = db_session.query(Order).all()
-                genre_stats = defaultdict(lambda: [])
-
-                for order in orders:
-                    for item in order.items:
-                        book = BookService.book_to_dict(item.book)
-                        genre = book['genre']
-                        book_dict = {
-                            'id': book['id'],
-                            'title': book['title'],
-                            'author': book['author'],
-                            'genre': book['genre'],
-                            'cover': book['cover'],
-                            'quantity_in_orders': book['quantity_in_orders']}
-                        if book_dict not in genre_stats[genre]:
-                            genre_stats[genre].append(
-                                {
-                                    'id': book['id'],
-                                    'title': book['title'],
-                                    'author': book['author'],
-                                    'genre': book['genre'],
-                                    'cover': book['cover'],
-                                    'quantity_in_orders': book['quantity_in_orders']}
-                            )
-
-                top_books_by_genre = {
-                    genre: sorted(genre_stats[genre], key=lambda item: item['quantity_in_orders'], reverse=True)[:3]
-                    for genre in genre_stats
-                }
+                ranked = (
+                    select(BookSales.book_id,
+                           BookSales.units_sold,
+                           func.row_number().over(partition_by=BookSales.genre,
+                                                  order_by=(BookSales.units_sold.desc(), BookSales.book_id))
+                           .label('place'))
+                    .where(BookSales.period == BookSales.ALL_TIME)
+                    .subquery()
+                )
+                rows = (
+                    db_session.query(Book.id, Book.title, Book.author, Book.genre, Book.cover, ranked.c.units_sold)
+                    .join(ranked, ranked.c.book_id == Book.id)
+                    .filter(ranked.c.place <= limit)
+                    .order_by(Book.genre, ranked.c.place)
+                    .all()
+                )
+
+                top_books_by_genre = defaultdict(list)
+                for row in rows:
+                    top_books_by_genre[row.genre].append({
+                        'id': row.id,
+                        'title': row.title,
+                        'author': row.author,
+                        'genre': row.genre,
+                        'cover': row.cover,
+                        'quantity_in_orders': row.units_sold
+                    })
 
-                return top_books_by_genre
+                return dict(top_books_by_genre)
 
         except DatabaseError as db_error:
             raise DatabaseOperationError('Ошибка при работе с базой данных') from db_error
@@ -396,64 +540,114 @@ class BookService:
             raise ServiceError('Внутренняя ошибка сервиса книг') from error
 
 
-class CartService:
-    @staticmethod
-    def cart_item_to_dict(cart_item):
-        """Возвращает объект из cart_item в виде словаря"""
-        if not cart_item:
-            raise ValueError('Товар не найден в корзине')
-        try:
-            return {
-                'id': cart_item.id,
-                'user_id': cart_item.user_id,
-                'book_id': cart_item.book_id,
-                'quantity': cart_item.quantity,
-                'store_quantity': cart_item.book.quantity,
-                'title': cart_item.book.title,
-                'author': cart_item.book.author,
-                'price': float(cart_item.book.price),
-                'cover': cart_item.book.cover
-            }
-        except AttributeError as e:
-            raise ValueError(f"Некорректный объект товара: {e}") from e
-        except TypeError as e:
-            raise ValueError(f"Ошибка в данных товара: {e}") from e
-
-    @staticmethod
-    def get_cart(user_id):
-        """Получаем корзину пользователя по его id в виде списка словарей"""
-        try:
-            with session_scope() as db_session:
-                db_cart = db_session.query(CartItem).filter_by(user_id=user_id).all()
-                return [CartService.cart_item_to_dict(item) for item in db_cart]
+class ReservationService:
+    @staticmethod
+    def now():
+        """Текущее время в UTC без часового пояса — в этом виде хранится expires_at"""
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+
+    @staticmethod
+    def reserved_by_others(book_id, user_id, now):
+        """Подзапрос: сколько экземпляров книги зарезервировано другими пользователями на момент now"""
+        return (
+            select(func.coalesce(func.sum(Reservation.quantity), 0))
+            .where(Reservation.book_id == book_id, Reservation.user_id != user_id, Reservation.expires_at > now)
+            .scalar_subquery()
+        )
+
+    @staticmethod
+    def reserve(db_session, user_id, book_id, quantity):
+        """Резервирует за пользователем quantity экземпляров книги на RESERVATION_TTL одним запросом.
+
+        Резерв создается или продлевается, только если остаток за вычетом чужих активных резервов
+        не меньше quantity; возвращает False, если свободных экземпляров не хватает.
+        """
+        now = ReservationService.now()
+        expires_at = now + timedelta(seconds=settings.RESERVATION_TTL)
+        source = (
+            select(literal(user_id), Book.id, literal(quantity), literal(expires_at, DateTime))
+            .where(Book.id == book_id,
+                   Book.quantity - ReservationService.reserved_by_others(book_id, user_id, now) >= quantity)
+        )
+        statement = sqlite_insert(Reservation).from_select(['user_id', 'book_id', 'quantity', 'expires_at'], source)
+        statement = statement.on_conflict_do_update(
+            index_elements=['user_id', 'book_id'],
+            set_={'quantity': statement.excluded.quantity, 'expires_at': statement.excluded.expires_at}
+        )
+        return db_session.execute(statement).rowcount > 0
+
+    @staticmethod
+    def shrink(db_session, user_id, book_id, quantity):
+        """Уменьшает резерв пользователя до quantity экземпляров; уменьшение всегда возможно"""
+        db_session.execute(
+            update(Reservation)
+            .where(Reservation.user_id == user_id, Reservation.book_id == book_id)
+            .values(quantity=func.min(Reservation.quantity, quantity))
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    def release(db_session, user_id, book_ids=None):
+        """Снимает резервы пользователя: на перечисленные книги или все"""
+        statement = delete(Reservation).where(Reservation.user_id == user_id)
+        if book_ids is not None:
+            statement = statement.where(Reservation.book_id.in_(book_ids))
+        db_session.execute(statement.execution_options(synchronize_session=False))
+
+    @staticmethod
+    def sweep_expired():
+        """Удаляет истекшие резервы, возвращает их число"""
+        try:
+            with transaction() as db_session:
+                return db_session.execute(
+                    delete(Reservation)
+                    .where(Reservation.expires_at <= ReservationService.now())
+                    .execution_options(synchronize_session=False)
+                ).rowcount
         except DatabaseError as db_error:
-            raise DatabaseOperationError("Ошибка при работе с базой данных") from db_error
+            raise DatabaseOperationError('Ошибка при работе с базой данных') from db_error
         except SQLAlchemyError as sql_error:
-            raise DataAccessError("Ошибка доступа к данным") from sql_error
-        except Exception as error:
-            raise ServiceError("Внутренняя ошибка сервиса книг") from error
+            raise DataAccessError('Ошибка доступа к данным') from sql_error
 
-    @staticmethod
-    def get_available_items_from_cart(user_id):
-        """Получаем доступные товары из корзины пользователя по его id"""
-        try:
-            with session_scope() as db_session:
-                db_cart = db_session.query(CartItem).filter_by(user_id=user_id).all()
-                return [CartService.cart_item_to_dict(item) for item in db_cart if item.book.quantity >= 1]
-        except DatabaseError as db_error:
-            raise DatabaseOperationError("Ошибка при работе с базой данных") from db_error
-        except SQLAlchemyError as sql_error:
-            raise DataAccessError("Ошибка доступа к данным") from sql_error
-        except Exception as error:
-            raise ServiceError("Внутренняя ошибка сервиса книг") from error
 
+class CartService:
     @staticmethod
-    def get_unavailable_items_from_cart(user_id):
-        """Получаем недоступные товары из корзины пользователя по его id"""
+    def get_cart_view(user_id):
+        """Получает корзину пользователя одним запросом: все товары, доступные, недоступные и итоги"""
+        # store_quantity — сколько экземпляров доступно пользователю: остаток без чужих активных резервов
+        reserved = ReservationService.reserved_by_others(CartItem.book_id, user_id, ReservationService.now())
         try:
             with session_scope() as db_session:
-                db_cart = db_session.query(CartItem).filter_by(user_id=user_id).all()
-                return [CartService.cart_item_to_dict(item) for item in db_cart if item.book.quantity == 0]
+                rows = (
+                    db_session.query(CartItem.id,
+                                     CartItem.user_id,
+                                     CartItem.book_id,
+                                     CartItem.quantity,
+                                     (Book.quantity - reserved).label('store_quantity'),
+                                     Book.title,
+                                     Book.author,
+                                     Book.price,
+                                     Book.cover)
+                    .join(Book, Book.id == CartItem.book_id)
+                    .filter(CartItem.user_id == user_id)
+                    .order_by(CartItem.id)
+                    .all()
+                )
+                items = []
+                for row in rows:
+                    item = row._asdict()
+                    item['price'] = float(item['price'])
+                    items.append(item)
+
+                available = [item for item in items if item['store_quantity'] >= 1]
+                unavailable = [item for item in items if item['store_quantity'] < 1]
+                return {
+                    'items': items,
+                    'available': available,
+                    'unavailable': unavailable,
+                    'total_quantity': sum(item['quantity'] for item in available),
+                    'total_price': round(sum(item['price'] * item['quantity'] for item in available), 2)
+                }
         except DatabaseError as db_error:
             raise DatabaseOperationError("Ошибка при работе с базой данных") from db_error
         except SQLAlchemyError as sql_error:
@@ -465,21 +659,26 @@ class CartService:
     def handle_cart_actions(item_id, action):
         """Управляем действиями пользователя в корзине: добавление и удаление единиц товара"""
         try:
-            with session_scope() as db_session:
+            with transaction() as db_session:
                 cart_item = db_session.query(CartItem).get(item_id)
                 if not cart_item:
                     raise ValueError(f'В корзине не найден товар с id {item_id}')
                 if action == 'add':
-                    if cart_item.book.quantity >= cart_item.quantity + 1:
-                        cart_item.quantity += 1
-                    else:
-                        raise ValueError(
+                    if not ReservationService.reserve(db_session, cart_item.user_id, cart_item.book_id,
+                                                      cart_item.quantity + 1):
+                        raise OutOfStockError(
                             f'Вы не можете добавить еще один товар {cart_item.book.author} "{cart_item.book.title}" в корзину'
                         )
+                    cart_item.quantity += 1
                 elif action == 'delete':
                     cart_item.quantity -= 1
                     if cart_item.quantity <= 0:
+                        ReservationService.release(db_session, cart_item.user_id, [cart_item.book_id])
                         db_session.delete(cart_item)
+                    else:
+                        ReservationService.shrink(db_session, cart_item.user_id, cart_item.book_id, cart_item.quantity)
+        except OutOfStockError:
+            raise
         except DatabaseError as db_error:
             raise DatabaseOperationError("Ошибка при работе с базой данных") from db_error
         except SQLAlchemyError as sql_error:
@@ -491,11 +690,11 @@ class CartService:
     def clear_users_cart(user_id):
         """Очищение корзины"""
         try:
-            with session_scope() as db_session:
+            with transaction() as db_session:
                 cart = db_session.query(CartItem).filter_by(user_id=user_id).first()
                 if cart:
                     db_session.query(CartItem).filter(CartItem.user_id == user_id).delete()
-                    db_session.commit()
+                ReservationService.release(db_session, user_id)
         except DatabaseError as db_error:
             raise DatabaseOperationError("Ошибка при работе с базой данных") from db_error
         except SQLAlchemyError as sql_error:
@@ -524,7 +723,9 @@ class OrderService:
                 'updated_at': order.updated_at,
                 'status': order.status.display_name,
                 'delivery_method': order.delivery_method.display_name,
-                'address': order.address
+                'address': order.address,
+                'total_amount': order.total_amount,
+                'item_count': order.item_count
             }
         except AttributeError as e:
             raise ValueError('Некорректный объект заказа') from e
@@ -546,13 +747,22 @@ class OrderService:
             raise ServiceError("Внутренняя ошибка сервиса") from error
 
     @staticmethod
-    def users_orders_to_dict(user_id):
-        """Получение всех заказов пользователя по его id"""
+    def get_order_history(user_id, cursor=None, limit=None):
+        """Страница истории заказов пользователя (новые первыми) с числом товаров и суммой каждого заказа"""
+        after = catalog.decode_cursor(cursor, 'orders') if cursor else None
+        limit = limit or settings.ORDERS_PAGE_SIZE
+        # курсор хранит created_at в том виде, в каком он записан в БД, чтобы сравнение было точным
+        created_key = type_coerce(Order.created_at, String)
         try:
             with session_scope() as db_session:
-                users_orders = db_session.query(Order).filter_by(user_id=user_id).all()
-                result = sorted((OrderService.order_to_dict(order) for order in users_orders), key=lambda item: item['id'], reverse=True)
-                return result
+                query = (
+                    db_session.query(Order.id, Order.created_at, created_key.label('created_key'), Order.status,
+                                     Order.item_count, Order.total_amount)
+                    .filter(Order.user_id == user_id)
+                )
+                if after:
+                    query = query.filter(tuple_(created_key, Order.id) < tuple_(*after))
+                rows = query.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit + 1).all()
         except DatabaseError as db_error:
             raise DatabaseOperationError("Ошибка при работе с базой данных") from db_error
         except SQLAlchemyError as sql_error:
@@ -560,47 +770,88 @@ class OrderService:
         except Exception as error:
             raise ServiceError("Внутренняя ошибка сервиса") from error
 
-    @staticmethod
-    def create_order(user_id, address, delivery_method):
-        """Создание записи о заказе в модели Order"""
-        try:
-            with session_scope() as db_session:
-                now = datetime.now().astimezone()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = catalog.encode_cursor((rows[-1].created_key, rows[-1].id), 'orders')
+        return {
+            'orders': [{'id': row.id,
+                        'created_at': row.created_at,
+                        'status': row.status.display_name,
+                        'item_count': row.item_count,
+                        'total_amount': row.total_amount}
+                       for row in rows],
+            'next_cursor': next_cursor
+        }
+
+    @staticmethod
+    def place_order(user_id, address, delivery_method):
+        """Оформляет заказ из доступных товаров корзины одной транзакцией, возвращает id заказа"""
+        try:
+            with transaction() as db_session:
+                # доступен остаток за вычетом чужих активных резервов; свои резервы заказ потребляет
+                now = ReservationService.now()
+                available = Book.quantity - ReservationService.reserved_by_others(Book.id, user_id, now)
+                # в заказ идет не больше доступного остатка, остальное количество позиции не заказывается
+                lines = (
+                    db_session.query(CartItem.id,
+                                     CartItem.book_id,
+                                     func.min(CartItem.quantity, available).label('quantity'),
+                                     Book.price,
+                                     Book.genre)
+                    .join(Book, Book.id == CartItem.book_id)
+                    .filter(CartItem.user_id == user_id, available >= 1)
+                    .all()
+                )
+                if not lines:
+                    raise OutOfStockError('В корзине отсутствуют доступные для заказа товары')
 
+                created_at = datetime.now().astimezone()
                 new_order = Order(
                     user_id=user_id,
                     address=address,
                     delivery_method=delivery_method,
-                    created_at=now,
-                    updated_at=now
+                    created_at=created_at,
+                    updated_at=created_at,
+                    total_amount=sum(line.price * line.quantity for line in lines),
+                    item_count=sum(line.quantity for line in lines)
                 )
                 db_session.add(new_order)
-                db_session.commit()
-                return new_order
-        except DatabaseError as db_error:
-            raise DatabaseOperationError("Ошибка при работе с базой данных") from db_error
-        except SQLAlchemyError as sql_error:
-            raise DataAccessError("Ошибка доступа к данным") from sql_error
-        except Exception as error:
-            raise ServiceError("Внутренняя ошибка сервиса") from error
-
-    @staticmethod
-    def create_order_item(order_id, book_id, quantity, price, user_id):
-        """Создание записи о единицах товара в модели OrderItem"""
-        try:
-            with session_scope() as db_session:
-                new_order_item = OrderItem(order_id=order_id,
-                                           book_id=book_id,
-                                           quantity=quantity,
-                                           price=price)
-                db_session.add(new_order_item)
-                item_to_reduce = db_session.query(Book).get(book_id)
-                item_to_reduce.quantity -= new_order_item.quantity
-                cart_items = db_session.query(CartItem).filter(CartItem.book_id == book_id, CartItem.user_id != user_id).all()
-                print(cart_items)
-                for item in cart_items:
-                    if item.quantity > item_to_reduce.quantity:
-                        item.quantity = item_to_reduce.quantity
+                db_session.flush()
+
+                db_session.execute(insert(OrderItem), [
+                    {'order_id': new_order.id,
+                     'book_id': line.book_id,
+                     'quantity': line.quantity,
+                     'price': line.price} for line in lines
+                ])
+
+                cart_item_ids = [line.id for line in lines]
+                book_ids = [line.book_id for line in lines]
+                ordered_quantity = case({line.book_id: line.quantity for line in lines}, value=Book.id)
+                reduced = db_session.execute(
+                    update(Book)
+                    .where(Book.id.in_(book_ids), available >= ordered_quantity)
+                    .values(quantity=Book.quantity - ordered_quantity)
+                    .execution_options(synchronize_session=False)
+                )
+                if reduced.rowcount != len(lines):
+                    raise OutOfStockError('Недостаточно экземпляров книг для оформления заказа')
+
+                BookService.record_sales(db_session,
+                                         [(line.book_id, line.genre, line.quantity, line.price) for line in lines],
+                                         created_at)
+                ReservationService.release(db_session, user_id, book_ids)
+                OrderService._clamp_competing_carts(db_session, user_id, book_ids)
+                db_session.execute(
+                    delete(CartItem)
+                    .where(CartItem.id.in_(cart_item_ids))
+                    .execution_options(synchronize_session=False)
+                )
+                catalog.bump_version(db_session)
+                return new_order.id
+        except OutOfStockError:
+            raise
         except DatabaseError as db_error:
             raise DatabaseOperationError("Ошибка при работе с базой данных") from db_error
         except SQLAlchemyError as sql_error:
@@ -609,33 +860,44 @@ class OrderService:
             raise ServiceError("Внутренняя ошибка сервиса") from error
 
     @staticmethod
-    def get_last_order(user_id):
-        """Получение последнего заказа пользователя из модели Order"""
-        try:
-            with session_scope() as db_session:
-                last_order = db_session.query(Order).filter_by(user_id=user_id).order_by(Order.created_at.desc()).first()
-                return OrderService.order_to_dict(last_order) if last_order else None
-        except DatabaseError as db_error:
-            raise DatabaseOperationError("Ошибка при работе с базой данных") from db_error
-        except SQLAlchemyError as sql_error:
-            raise DataAccessError("Ошибка доступа к данным") from sql_error
-        except Exception as error:
-            raise ServiceError("Внутренняя ошибка сервиса") from error
+    def _clamp_competing_carts(db_session, user_id, book_ids):
+        """Уменьшает количество книг в чужих корзинах до оставшегося остатка одним UPDATE"""
+        stock = select(Book.quantity).where(Book.id == CartItem.book_id).scalar_subquery()
+        db_session.execute(
+            update(CartItem)
+            .where(CartItem.book_id.in_(book_ids), CartItem.user_id != user_id, CartItem.quantity > stock)
+            .values(quantity=stock)
+            .execution_options(synchronize_session=False)
+        )
 
     @staticmethod
-    def delete_cart_item(item_id):
-        """Удаление товара из корзины"""
+    def rebuild_order_totals():
+        """Пересчитывает сумму и число товаров всех заказов одним сгруппированным запросом"""
         try:
-            with session_scope() as db_session:
-                item_to_delete = db_session.query(CartItem).get(item_id)
-                db_session.delete(item_to_delete)
-                db_session.commit()
+            with transaction() as db_session:
+                totals = (
+                    select(OrderItem.order_id,
+                           func.sum(OrderItem.quantity).label('item_count'),
+                           func.sum(OrderItem.quantity * OrderItem.price).label('total_amount'))
+                    .group_by(OrderItem.order_id)
+                    .subquery()
+                )
+                # updated_at — время смены статуса, пересчет итогов его не меняет
+                db_session.execute(
+                    update(Order)
+                    .where(~Order.id.in_(select(OrderItem.order_id)))
+                    .values(item_count=0, total_amount=0, updated_at=Order.updated_at)
+                )
+                return db_session.execute(
+                    update(Order)
+                    .where(Order.id == totals.c.order_id)
+                    .values(item_count=totals.c.item_count, total_amount=totals.c.total_amount,
+                            updated_at=Order.updated_at)
+                ).rowcount
         except DatabaseError as db_error:
-            raise DatabaseOperationError("Ошибка при работе с базой данных") from db_error
+            raise DatabaseOperationError('Ошибка при работе с базой данных') from db_error
         except SQLAlchemyError as sql_error:
-            raise DataAccessError("Ошибка доступа к данным") from sql_error
-        except Exception as error:
-            raise ServiceError("Внутренняя ошибка сервиса") from error
+            raise DataAccessError('Ошибка доступа к данным') from sql_error
 
     @staticmethod
     def get_store_addresses():
@@ -677,10 +939,15 @@ class OrderService:
 
     @staticmethod
     def get_order_items_in_order(order_id):
-        """Получение всех единиц товара в заказе"""
+        """Получение всех единиц товара в заказе вместе с данными книг одним запросом"""
         try:
             with session_scope() as db_session:
-                order_items = db_session.query(OrderItem).filter_by(order_id=order_id).all()
+                order_items = (
+                    db_session.query(OrderItem)
+                    .options(joinedload(OrderItem.book))
+                    .filter_by(order_id=order_id)
+                    .all()
+                )
                 return [OrderService.order_item_to_dict(order_item) for order_item in order_items]
         except DatabaseError as db_error:
             raise DatabaseOperationError("Ошибка при работе с базой данных") from db_error
@@ -689,31 +956,11 @@ class OrderService:
         except Exception as error:
             raise ServiceError("Внутренняя ошибка сервиса") from error
 
-    @staticmethod
-    def time_to_string(time_obj):
-        """Преобразование времени в строку"""
-        try:
-            if not isinstance(time_obj, datetime):
-                raise ValueError("Должен быть передан объект datetime")
-
-            result = time_obj.strftime('%d-%m-%Y %H:%M')
-
-            return result
-
-        except ValueError as e:
-            raise ValueError(f"Ошибка значения времени: {str(e)}") from e
-        except TypeError as e:
-            raise TypeError(f"Неподдерживаемый тип времени: {str(e)}") from e
-        except AttributeError as e:
-            raise AttributeError(f"Отсутствует необходимый атрибут: {str(e)}") from e
-        except Exception as e:
-            raise ServiceError(f"Ошибка преобразования времени: {str(e)}") from e
-
     @staticmethod
     def update_order_status(order_id, status):
         """Обновление статуса заказа"""
         try:
-            with session_scope() as db_session:
+            with transaction() as db_session:
                 order = db_session.query(Order).get(order_id)
                 if not order:
                     raise ValueError('Заказ не найден')
@@ -721,8 +968,6 @@ class OrderService:
                     order.status = OrderStatusEnum(status)
                 except ValueError:
                     raise ValueError(f'Неверный статус заказа. Допустимые значения: {[e.value for e in OrderStatusEnum]}')
-
-                db_session.commit()
         except DatabaseError as db_error:
             raise DatabaseOperationError("Ошибка при работе с базой данных") from db_error
         except SQLAlchemyError as sql_error:
@@ -0,0 +1,253 @@
+"""Бенчмарк основных страниц магазина через тестовый клиент Flask.
+
+Заполняет временную БД синтетическим каталогом (benchmarks/generate_data.py) и для каждого сценария
+замеряет задержку (p50/p95/p99), число SQL-запросов на запрос и пиковую память.
+
+Пример:
+    python -m benchmarks.bench_routes --books 10000 --save-baseline benchmarks/baseline.json
+    python -m benchmarks.bench_routes --books 10000 --baseline benchmarks/baseline.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+SCENARIOS = ('home', 'catalog', 'search', 'book', 'cart', 'checkout')
+SEARCH_QUERIES = ['тайна', 'свет мира', 'кинг', 'фантастика', 'путь 12', 'лабиринт времени']
+CHECKOUT_MIN_STOCK = 50
+CHECKOUT_ADDRESS = {
+    'form_type': 'address_details',
+    'city': 'Москва',
+    'street': 'Парковая',
+    'house_number': '23',
+    'building_number': '',
+    'entrance': '',
+    'intercom': '',
+    'floor': '',
+    'apartment': '',
+    'comment': ''
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def prepare_environment(workdir):
+    """Направляет приложение на временную БД до первого импорта app"""
+    os.environ['DATABASE_URL'] = f'sqlite:///{Path(workdir) / "bench.db"}'
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ.setdefault('APP_PORT', '5000')
+
+
+def seed_database(data_dir):
+    """Создает схему и загружает синтетические данные, возвращает отчеты загрузчика"""
+    from app.database import init_db, session_scope
+    from app.bulk_load import BulkLoader, iter_records
+    from app.services import BookService
+    from app import catalog
+
+    init_db()
+    reports = []
+    with session_scope() as db_session:
+        loader = BulkLoader(db_session.connection())
+        for kind in ('books', 'users', 'reviews', 'orders'):
+            result = getattr(loader, f'load_{kind}')(iter_records(Path(data_dir) / f'{kind}.jsonl'))
+            reports.extend(result if isinstance(result, list) else [result])
+        catalog.bump_version(db_session)
+    BookService.rebuild_sales_stats()
+    return reports
+
+
+class QueryCounter:
+    """Считает SQL-запросы движка приложения"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+class RouteBench:
+    """Сценарии запросов к приложению; каждый сценарий возвращает ответ одного измеряемого запроса"""
+
+    def __init__(self, app, books_count, user_id, checkout_book_ids, seed=42):
+        import random
+        self.app = app
+        self.books_count = books_count
+        self.user_id = user_id
+        self.checkout_book_ids = checkout_book_ids
+        self.rng = random.Random(seed)
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+
+    def _book_id(self):
+        return self.rng.randint(1, self.books_count)
+
+    def home(self):
+        return self.client.get('/')
+
+    def catalog(self):
+        return self.client.get('/catalog')
+
+    def search(self):
+        return self.client.post('/search', data={'search_query': self.rng.choice(SEARCH_QUERIES)})
+
+    def book(self):
+        return self.client.get(f'/books/{self._book_id()}')
+
+    def cart(self):
+        return self.client.get(f'/cart/{self.user_id}')
+
+    def prepare_checkout(self):
+        self.client.post(f'/books/{self.rng.choice(self.checkout_book_ids)}', data={'form_type': 'add_book'})
+
+    def checkout(self):
+        response = self.client.post(f'/orders/new-order/{self.user_id}', data=CHECKOUT_ADDRESS)
+        # без товаров в наличии оформление тоже отвечает 302, но возвращает в корзину
+        location = response.headers.get('Location', '')
+        if '/order_payment/' not in location:
+            raise RuntimeError(f'checkout: заказ не оформлен, переход на {location or response.status_code}')
+        return response
+
+
+def run_scenario(bench, counter, name, requests):
+    """Прогоняет сценарий: сначала задержки и запросы, затем отдельный проход для пиковой памяти"""
+    action = getattr(bench, name)
+    prepare = getattr(bench, f'prepare_{name}', None)
+
+    # прогрев: снимок каталога, поисковый индекс, шаблоны
+    for _ in range(min(5, requests)):
+        if prepare:
+            prepare()
+        action()
+
+    latencies = []
+    queries = []
+    for _ in range(requests):
+        if prepare:
+            prepare()
+        queries_before = counter.count
+        started = time.perf_counter()
+        response = action()
+        latencies.append((time.perf_counter() - started) * 1000)
+        queries.append(counter.count - queries_before)
+        if response.status_code >= 400:
+            raise RuntimeError(f'{name}: ответ {response.status_code}')
+
+    peak = 0
+    for _ in range(min(20, requests)):
+        if prepare:
+            prepare()
+        tracemalloc.start()
+        action()
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {
+        'requests': requests,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'queries_per_request': round(statistics.fmean(queries), 2),
+        'max_queries': max(queries),
+        'peak_memory_kib': round(peak / 1024, 1)
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Список регрессий относительно сохраненного прогона"""
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        for metric in ('p95_ms', 'peak_memory_kib'):
+            if current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f'{name}: {metric} {previous[metric]} -> {current[metric]}')
+        if current['queries_per_request'] > previous['queries_per_request']:
+            regressions.append(f'{name}: queries_per_request '
+                               f'{previous["queries_per_request"]} -> {current["queries_per_request"]}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк страниц магазина')
+    parser.add_argument('--books', type=int, default=10_000, help='Размер синтетического каталога')
+    parser.add_argument('--data', help='Папка с готовыми .jsonl файлами вместо генерации')
+    parser.add_argument('--requests', type=int, default=200, help='Измеряемых запросов на сценарий')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='Запустить только эти сценарии')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Куда записать результаты в JSON')
+    parser.add_argument('--save-baseline', help='Сохранить результаты как базовый прогон')
+    parser.add_argument('--baseline', help='Сравнить с базовым прогоном')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Допустимый рост p95 и памяти, доля')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bookstore-bench-')
+    prepare_environment(workdir)
+
+    from benchmarks.generate_data import generate
+    data_dir = args.data
+    if data_dir is None:
+        data_dir = Path(workdir) / 'data'
+        generate(data_dir, args.books, seed=args.seed)
+
+    for report in seed_database(data_dir):
+        print(report, file=sys.stderr)
+
+    from app import create_app
+    from app.database import engine
+    from app.models import Book, User
+    from app.database import session_scope
+
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with session_scope() as db_session:
+        books_count = db_session.query(Book).count()
+        user_id = db_session.query(User.id).order_by(User.id).limit(1).scalar()
+        # книги с запасом остатка, чтобы каждый оформленный заказ действительно списывал книгу
+        checkout_book_ids = [row.id for row in db_session.query(Book.id).filter(Book.quantity >= CHECKOUT_MIN_STOCK)]
+
+    bench = RouteBench(app, books_count, user_id, checkout_book_ids, seed=args.seed)
+    counter = QueryCounter(engine)
+    results = {
+        'books': books_count,
+        'python': sys.version.split()[0],
+        'scenarios': {}
+    }
+    for name in args.scenario or SCENARIOS:
+        results['scenarios'][name] = run_scenario(bench, counter, name, args.requests)
+        print(f'{name}: {results["scenarios"][name]}', file=sys.stderr)
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    print(output)
+    for path in filter(None, (args.output, args.save_baseline)):
+        Path(path).write_text(output, encoding='utf-8')
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        if baseline.get('books') != books_count:
+            print(f'Базовый прогон снят на {baseline.get("books")} книгах, сейчас {books_count}', file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'Регрессия: {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Бенчмарк холодного старта: импорт пакета app, create_app() и первый запрос.
+
+Каждый прогон — отдельный процесс интерпретатора на заранее подготовленной временной БД,
+поэтому замер включает все, что выполняется при импорте, но не заполнение БД.
+
+Пример:
+    python -m benchmarks.bench_startup --runs 15 --save-baseline benchmarks/startup_baseline.json
+    python -m benchmarks.bench_startup --runs 15 --baseline benchmarks/startup_baseline.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.bench_routes import percentile, prepare_environment
+
+ROOT = Path(__file__).resolve().parent.parent
+PHASES = ('import_ms', 'create_app_ms', 'first_request_ms', 'process_ms')
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+modules_before = len(sys.modules)
+import app
+imported = time.perf_counter()
+modules_after_import = len(sys.modules)
+application = app.create_app()
+created = time.perf_counter()
+response = application.test_client().get({path!r})
+answered = time.perf_counter()
+print(json.dumps({{
+    'status': response.status_code,
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (answered - created) * 1000,
+    'modules_on_import': modules_after_import - modules_before
+}}))
+'''
+
+
+def run_probe(path):
+    """Один холодный старт в новом процессе; process_ms — от запуска интерпретатора до выхода"""
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', PROBE.format(path=path)], cwd=ROOT,
+                               capture_output=True, text=True, env=os.environ.copy())
+    elapsed = (time.perf_counter() - started) * 1000
+    if completed.returncode != 0:
+        raise RuntimeError(f'Процесс замера завершился с ошибкой:\n{completed.stderr}')
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    if result['status'] >= 400:
+        raise RuntimeError(f'{path}: ответ {result["status"]}')
+    result['process_ms'] = elapsed
+    return result
+
+
+def summarize(samples):
+    summary = {}
+    for phase in PHASES:
+        values = [sample[phase] for sample in samples]
+        summary[phase] = {
+            'p50': round(percentile(values, 0.50), 2),
+            'p95': round(percentile(values, 0.95), 2),
+            'mean': round(statistics.fmean(values), 2)
+        }
+    summary['modules_on_import'] = max(sample['modules_on_import'] for sample in samples)
+    return summary
+
+
+def compare(results, baseline, tolerance):
+    """Список регрессий относительно сохраненного прогона"""
+    regressions = []
+    for phase in PHASES:
+        previous = baseline.get(phase, {}).get('p50')
+        current = results[phase]['p50']
+        if previous and current > previous * (1 + tolerance):
+            regressions.append(f'{phase}: p50 {previous} -> {current}')
+    if results['modules_on_import'] > baseline.get('modules_on_import', results['modules_on_import']):
+        regressions.append(f'modules_on_import: {baseline["modules_on_import"]} -> {results["modules_on_import"]}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк холодного старта приложения')
+    parser.add_argument('--runs', type=int, default=10, help='Число холодных стартов')
+    parser.add_argument('--path', default='/', help='Страница первого запроса')
+    parser.add_argument('--output', help='Куда записать результаты в JSON')
+    parser.add_argument('--save-baseline', help='Сохранить результаты как базовый прогон')
+    parser.add_argument('--baseline', help='Сравнить с базовым прогоном')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Допустимый рост медианы, доля')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bookstore-startup-')
+    prepare_environment(workdir)
+    subprocess.run([sys.executable, '-c', 'from app.commands import prepare_database; prepare_database()'],
+                   cwd=ROOT, check=True, env=os.environ.copy())
+
+    # первый прогон компилирует .pyc и в замер не входит
+    run_probe(args.path)
+    samples = []
+    for _ in range(args.runs):
+        samples.append(run_probe(args.path))
+        print(f'{samples[-1]}', file=sys.stderr)
+
+    results = {'python': sys.version.split()[0], 'runs': args.runs, 'path': args.path, **summarize(samples)}
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    print(output)
+    for path in filter(None, (args.output, args.save_baseline)):
+        Path(path).write_text(output, encoding='utf-8')
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'Регрессия: {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""Детерминированный генератор большого каталога для нагрузочных тестов.
+
+Пример:
+    python -m benchmarks.generate_data --books 100000 --out benchmarks/data/100k
+"""
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+
+SCALES = {
+    '10k': 10_000,
+    '100k': 100_000,
+    '1m': 1_000_000
+}
+
+# доли жанров повторяют перекос исходного каталога
+GENRES = {
+    'Приключения': 15,
+    'Фантастика': 14,
+    'Фэнтези': 12,
+    'Саморазвитие': 12,
+    'Детская литература': 12,
+    'История': 10,
+    'Научная литература': 8,
+    'Роман': 6,
+    'Бизнес': 6,
+    'Детектив': 5
+}
+AUTHORS = ['Айзек Азимов', 'Джоан Роулинг', 'Джордж Оруэлл', 'Лев Толстой', 'Михаил Булгаков',
+           'Рэй Брэдбери', 'Стивен Кинг', 'Фёдор Достоевский', 'Харуки Мураками', 'Эрих Мария Ремарк']
+TITLE_HEADS = ['Время', 'Голос', 'Звезда', 'Лабиринт', 'Мир', 'Огонь', 'Путь', 'Свет', 'Тайна', 'Тень']
+TITLE_TAILS = ['будущего', 'воли', 'времени', 'гнева', 'души', 'мира', 'прошлого', 'реальности', 'тишины', 'тумана']
+DESCRIPTIONS = ['Увлекательное приключение с неожиданным концом.',
+                'Откровенный рассказ о внутренней борьбе.',
+                'Глубокое исследование человеческой природы.',
+                'История, которая не отпускает до последней страницы.']
+REVIEWS = ['Отличная книга! Рекомендую всем любителям жанра.',
+           'Не смог дочитать до конца. Сюжет показался скучным.',
+           'Неплохо, но ожидал большего.',
+           'Перечитываю уже второй раз.']
+STORE_ADDRESS = 'г. Москва, ул. Тверская, д. 43, к. 1'
+
+
+def zipf_weights(count, exponent=1.1):
+    """Веса популярности: немногие книги собирают большую часть отзывов и продаж"""
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+def generate_books(rng, count):
+    genres = list(GENRES)
+    genre_weights = list(GENRES.values())
+    for number in range(1, count + 1):
+        yield {
+            'title': f'{rng.choice(TITLE_HEADS)} {rng.choice(TITLE_TAILS)} {number}',
+            'author': rng.choice(AUTHORS),
+            'price': round(rng.uniform(150, 1500), 2),
+            'genre': rng.choices(genres, genre_weights)[0],
+            'description': rng.choice(DESCRIPTIONS),
+            'pages': rng.randint(80, 1200),
+            'rating': round(rng.uniform(1, 5), 1),
+            'year': rng.randint(1900, 2025),
+            'quantity': rng.randint(0, 100)
+        }
+
+
+def generate_users(count):
+    for number in range(1, count + 1):
+        yield {
+            'name': 'Читатель',
+            'surname': f'Номер{number}',
+            'email': f'reader{number}@example.com',
+            'phone': f'8{number:010d}',
+            'password': 'benchmark-password'
+        }
+
+
+def generate_reviews(rng, books_count, users_count, reviews_per_book):
+    """Отзывы с перекосом по популярности, не больше одного отзыва пользователя на книгу"""
+    weights = zipf_weights(books_count)
+    scale = reviews_per_book * books_count / sum(weights)
+    for book_id, weight in enumerate(weights, start=1):
+        reviews_count = min(users_count, int(weight * scale) + (1 if rng.random() < 0.3 else 0))
+        for user_id in rng.sample(range(1, users_count + 1), reviews_count):
+            yield {
+                'review': rng.choice(REVIEWS),
+                'user_id': user_id,
+                'book_id': book_id,
+                'rating': rng.randint(1, 5)
+            }
+
+
+def generate_orders(rng, count, books_count, users_count, weeks, now):
+    book_ids = range(1, books_count + 1)
+    cumulative = []
+    total = 0
+    for weight in zipf_weights(books_count, exponent=0.9):
+        total += weight
+        cumulative.append(total)
+    for _ in range(count):
+        created_at = now - timedelta(days=rng.uniform(0, weeks * 7))
+        delivery_method = rng.choice(['pickup', 'door'])
+        yield {
+            'user_id': rng.randint(1, users_count),
+            'created_at': created_at.isoformat(),
+            'status': rng.choice(['new', 'paid', 'shipped', 'received']),
+            'delivery_method': delivery_method,
+            'address': STORE_ADDRESS if delivery_method == 'pickup' else 'г. москва, ул. парковая, д. 23',
+            'items': [{'book_id': book_id, 'quantity': rng.randint(1, 3)}
+                      for book_id in set(rng.choices(book_ids, cum_weights=cumulative, k=rng.randint(1, 5)))]
+        }
+
+
+def write_jsonl(path, records):
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False))
+            f.write('\n')
+            count += 1
+    return count
+
+
+def generate(out_dir, books, seed=42, reviews_per_book=3.0, orders=None, users=None, weeks=52):
+    """Пишет books/users/reviews/orders.jsonl в out_dir, возвращает число записей по файлам"""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    users = users or max(100, books // 10)
+    orders = orders if orders is not None else books // 2
+    rng = random.Random(seed)
+    now = datetime(2026, 1, 1)
+    return {
+        'books': write_jsonl(out_dir / 'books.jsonl', generate_books(rng, books)),
+        'users': write_jsonl(out_dir / 'users.jsonl', generate_users(users)),
+        'reviews': write_jsonl(out_dir / 'reviews.jsonl',
+                               generate_reviews(rng, books, users, reviews_per_book)),
+        'orders': write_jsonl(out_dir / 'orders.jsonl',
+                              generate_orders(rng, orders, books, users, weeks, now))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Генерация синтетического каталога')
+    parser.add_argument('--scale', choices=SCALES, help='Готовый размер каталога')
+    parser.add_argument('--books', type=int, help='Количество книг (вместо --scale)')
+    parser.add_argument('--out', required=True, help='Папка для .jsonl файлов')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reviews-per-book', type=float, default=3.0)
+    parser.add_argument('--orders', type=int, help='Количество заказов, по умолчанию половина числа книг')
+    args = parser.parse_args()
+
+    books = args.books or SCALES[args.scale or '10k']
+    counts = generate(args.out, books, seed=args.seed,
+                      reviews_per_book=args.reviews_per_book, orders=args.orders)
+    for name, count in counts.items():
+        print(f'{name}: {count}')
+
+
+if __name__ == '__main__':
+    main()
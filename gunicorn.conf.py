@@ -0,0 +1,72 @@
+"""Конфигурация gunicorn: несколько процессов-воркеров с потоками, перезапуск воркеров и плавная перезагрузка.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Параметры переопределяются переменными окружения GUNICORN_*. Мастер один раз готовит БД
+(схема и начальные данные, если версия БД устарела; прогрев каталога) и загружает приложение, воркеры получают
+его через fork и пересоздают пул соединений. Сигналы: HUP — плавный перезапуск воркеров с перечитыванием этого файла,
+USR2 затем TERM старому мастеру — обновление кода без простоя.
+"""
+import multiprocessing
+import os
+import tempfile
+from pathlib import Path
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+# метрики всех воркеров складываются через общую папку, ее нужно задать до импорта приложения
+os.environ.setdefault('METRICS_DIR', tempfile.mkdtemp(prefix='bookstore-metrics-'))
+
+from app.config import settings  # noqa: E402
+
+bind = os.environ.get('GUNICORN_BIND', f'0.0.0.0:{settings.APP_PORT}')
+workers = _env_int('GUNICORN_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8))
+threads = _env_int('GUNICORN_THREADS', 4)
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# воркер перезапускается после max_requests (± jitter, чтобы не все сразу) — защита от роста памяти
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 2000)
+max_requests_jitter = _env_int('GUNICORN_MAX_REQUESTS_JITTER', 200)
+timeout = _env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = _env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = _env_int('GUNICORN_KEEPALIVE', 5)
+
+# приложение загружается в мастере: воркеры делят с ним память и прогретый каталог
+preload_app = True
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+
+def on_starting(server):
+    """Готовит БД один раз в мастере, до запуска воркеров"""
+    from app.commands import prepare_database
+    from app.database import check_engine, engine
+    from app.services import BookService
+
+    # файлы воркеров прошлого запуска сервера не должны суммироваться с новыми
+    for path in Path(os.environ['METRICS_DIR']).glob('metrics-*.json'):
+        path.unlink(missing_ok=True)
+    prepare_database()
+    check_engine()
+    BookService.warm_catalog()
+    # соединения мастера не должны достаться воркерам
+    engine.dispose()
+    server.log.info('БД подготовлена, метрики воркеров: %s', os.environ['METRICS_DIR'])
+
+
+def post_fork(server, worker):
+    """Воркер открывает собственные соединения с БД, не трогая унаследованные от мастера"""
+    from app.database import engine
+
+    engine.dispose(close=False)
+
+
+def worker_exit(server, worker):
+    """Перед выходом воркер (в том числе по max_requests) выгружает накопленные метрики"""
+    from app.metrics import registry
+
+    registry.flush(force=True)
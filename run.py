@@ -1,16 +1,18 @@
-from app import app
+import logging
+from app import create_app
 from app.config import settings
-from app.commands import ensure_db_exists, init_books, init_reviews, init_users, init_store_address, init_orders
+from app.services import BookService
+from app.database import check_engine
+from app.commands import prepare_database
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     try:
-        ensure_db_exists()
-        init_books()
-        init_users()
-        init_reviews()
-        init_store_address()
-        init_orders()
+        app = create_app()
+        prepare_database()
+        check_engine()
+        BookService.warm_catalog()
 
         try:
             app.run(port=settings.APP_PORT, debug=True)
@@ -20,4 +22,3 @@ if __name__ == '__main__':
     except Exception as e:
         print(f"Ошибка: {e}")
         raise
-
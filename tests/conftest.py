@@ -0,0 +1,50 @@
+"""Общие фикстуры тестов: приложение на временной SQLite-БД с начальными данными"""
+import os
+import tempfile
+from pathlib import Path
+import pytest
+
+# настройки и движок создаются при первом обращении, поэтому окружение задается до импорта app
+WORKDIR = Path(tempfile.mkdtemp(prefix='bookstore-tests-'))
+os.environ['DATABASE_URL'] = f'sqlite:///{WORKDIR / "test.db"}'
+os.environ.setdefault('SECRET_KEY', 'test')
+os.environ.setdefault('APP_PORT', '5000')
+
+pytest_plugins = ['app.pytest_plugin']
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+    from app.commands import prepare_database
+
+    prepare_database()
+    application = create_app()
+    application.config['TESTING'] = True
+    return application
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def login(app):
+    """Клиент, авторизованный под пользователем user_id"""
+
+    def make_client(user_id):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        return client
+
+    return make_client
+
+
+@pytest.fixture
+def db(app):
+    """Соединение с тестовой БД в транзакции, фиксируемой по выходе из блока with"""
+    from app.database import get_engine
+    return get_engine().begin
@@ -0,0 +1,34 @@
+from sqlalchemy import text
+
+
+def _book_id(db):
+    with db() as connection:
+        return connection.execute(text('SELECT id FROM books ORDER BY id LIMIT 1')).scalar()
+
+
+def test_repeat_get_answers_304_by_etag(client, db):
+    book_id = _book_id(db)
+    first = client.get(f'/books/{book_id}')
+    assert first.status_code == 200 and first.headers['ETag']
+    repeat = client.get(f'/books/{book_id}', headers={'If-None-Match': first.headers['ETag']})
+    assert repeat.status_code == 304
+
+    with db() as connection:
+        connection.execute(text('UPDATE books SET price = price + 1 WHERE id = :book_id'), {'book_id': book_id})
+    assert client.get(f'/books/{book_id}', headers={'If-None-Match': first.headers['ETag']}).status_code == 200
+
+
+def test_etag_depends_on_user_and_arguments(client, login, db):
+    book_id = _book_id(db)
+    anonymous = client.get(f'/books/{book_id}').headers['ETag']
+    assert login(1).get(f'/books/{book_id}').headers['ETag'] != anonymous
+    assert client.get(f'/books/{book_id}?reviews_sort=rating').headers['ETag'] != anonymous
+
+
+def test_if_modified_since_alone_is_not_answered_with_304(client, db):
+    """Страница зависит от пользователя и параметров, поэтому время изменения книги не валидатор"""
+    book_id = _book_id(db)
+    response = client.get(f'/books/{book_id}')
+    assert 'Last-Modified' not in response.headers
+    repeat = client.get(f'/books/{book_id}', headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert repeat.status_code == 200
@@ -0,0 +1,148 @@
+import io
+import json
+from datetime import datetime
+from decimal import Decimal
+import pytest
+from sqlalchemy import create_engine, select, text
+from werkzeug.security import check_password_hash
+from app import bulk_load
+from app.bulk_load import BulkLoader, _iter_json_array
+from app.commands import init_store_address, init_users, store_addresses
+from app.models import Base, Order, OrderItem
+
+BOOKS = [
+    {'title': f'Книга {number}', 'author': 'Автор', 'price': price, 'genre': 'Проза', 'description': 'Описание',
+     'pages': 100, 'rating': 4.5, 'year': 2020, 'quantity': 10}
+    for number, price in enumerate(('100.50', '250.00', '99.90'), start=1)
+]
+USERS = [{'name': 'Иван', 'surname': 'Иванов', 'email': 'ivan@example.com', 'phone': '+79990000001',
+          'password_hash': 'hash'}]
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    """Куски чтения короче одной записи, чтобы записи попадали на границу куска"""
+    monkeypatch.setattr(bulk_load, 'CHUNK_SIZE', 7)
+
+
+@pytest.fixture
+def connection():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        loader = BulkLoader(connection)
+        loader.load_books(BOOKS)
+        loader.load_users(USERS)
+        yield connection
+    engine.dispose()
+
+
+def _order(items, **fields):
+    return {'user_id': 1, 'created_at': '2024-03-01T10:00:00', 'delivery_method': 'pickup',
+            'address': 'Москва', 'items': items, **fields}
+
+
+def test_records_spanning_chunk_boundary(small_chunks):
+    records = [{'id': number, 'title': 'Длинное название, которое не помещается в один кусок', 'tags': ['a', 'b']}
+               for number in range(20)]
+    source = '  [\n' + ',\n'.join(json.dumps(record, ensure_ascii=False) for record in records) + '\n]  '
+    assert list(_iter_json_array(io.StringIO(source))) == records
+
+
+def test_empty_array(small_chunks):
+    assert list(_iter_json_array(io.StringIO('  [ ]  '))) == []
+
+
+@pytest.mark.parametrize('source', [
+    '[{"id": 1}, {"id": 2',
+    '[{"id": 1}, {"id": 2}',
+    '[{"id": 1},',
+    ''
+])
+def test_truncated_array(small_chunks, source):
+    with pytest.raises(ValueError):
+        list(_iter_json_array(io.StringIO(source)))
+
+
+def test_not_an_array():
+    with pytest.raises(ValueError, match='Ожидался JSON-массив'):
+        list(_iter_json_array(io.StringIO('{"id": 1}')))
+
+
+def test_iter_records_json_and_jsonl(tmp_path, small_chunks):
+    records = [{'id': number, 'name': f'запись {number}'} for number in range(5)]
+    json_path = tmp_path / 'records.json'
+    json_path.write_text(json.dumps(records, ensure_ascii=False), encoding='utf-8')
+    jsonl_path = tmp_path / 'records.jsonl'
+    jsonl_path.write_text('\n'.join(json.dumps(record, ensure_ascii=False) for record in records) + '\n\n',
+                          encoding='utf-8')
+    assert list(bulk_load.iter_records(json_path)) == records
+    assert list(bulk_load.iter_records(jsonl_path)) == records
+
+
+def test_order_items_price_from_price_map(connection):
+    report = BulkLoader(connection).load_order_items([
+        {'order_id': 1, 'book_id': 1, 'quantity': 2},
+        {'order_id': 1, 'book_id': 2, 'price': None},
+        {'order_id': 1, 'book_id': 3, 'quantity': 1, 'price': '50.00'}
+    ])
+    assert report.rows == 3
+    rows = connection.execute(select(OrderItem.book_id, OrderItem.quantity, OrderItem.price)
+                              .order_by(OrderItem.book_id)).all()
+    assert [(row.book_id, row.quantity, Decimal(str(row.price))) for row in rows] == [
+        (1, 2, Decimal('100.50')), (2, 1, Decimal('250.00')), (3, 1, Decimal('50.00'))
+    ]
+
+
+def test_load_orders_in_batches(connection):
+    records = [
+        _order([{'book_id': 1, 'quantity': 2}, {'book_id': 2}]),
+        _order([{'book_id': 3, 'price': '10.00', 'quantity': 3}], id=10),
+        _order([]),
+        _order([{'book_id': 2}], created_at='2024-03-02T09:30:00+03:00', status='paid'),
+        _order([{'book_id': 1}, {'book_id': 3}])
+    ]
+    orders_report, items_report = BulkLoader(connection, batch_size=2).load_orders(records)
+    assert (orders_report.rows, items_report.rows) == (5, 6)
+
+    orders = connection.execute(
+        select(Order.id, Order.item_count, Order.total_amount, Order.created_at).order_by(Order.id)
+    ).all()
+    # заказы без id получают следующие свободные номера, заданный id сдвигает счетчик
+    assert [order.id for order in orders] == [1, 10, 11, 12, 13]
+    assert [(order.item_count, Decimal(str(order.total_amount))) for order in orders] == [
+        (3, Decimal('451.00')), (3, Decimal('30.00')), (0, Decimal('0')),
+        (1, Decimal('250.00')), (2, Decimal('200.40'))
+    ]
+    assert orders[3].created_at == datetime(2024, 3, 2, 9, 30)
+
+    items = connection.execute(select(OrderItem.order_id, OrderItem.book_id).order_by(OrderItem.id)).all()
+    assert [tuple(item) for item in items] == [(1, 1), (1, 2), (10, 3), (12, 2), (13, 1), (13, 3)]
+
+
+def test_load_orders_continues_after_existing_ids(connection):
+    loader = BulkLoader(connection, batch_size=1)
+    loader.load_orders([_order([{'book_id': 1}]), _order([{'book_id': 2}])])
+    loader.load_orders([_order([{'book_id': 3}])])
+    assert connection.execute(select(Order.id).order_by(Order.id)).scalars().all() == [1, 2, 3]
+
+
+def test_seeded_users_and_store_addresses(app, db):
+    """Начальные пользователи загружаются с хэшами паролей, повторное заполнение ничего не добавляет"""
+    def counts():
+        with db() as connection:
+            return (connection.execute(text('SELECT COUNT(*) FROM users')).scalar(),
+                    connection.execute(text('SELECT COUNT(*) FROM store_addresses')).scalar())
+
+    users_count, addresses_count = counts()
+    assert users_count > 0
+    assert addresses_count == len({(address['city'], address['street'], address['house'], address['building'])
+                                   for address in store_addresses})
+    init_users()
+    init_store_address()
+    assert counts() == (users_count, addresses_count)
+
+    with db() as connection:
+        password_hash = connection.execute(
+            text("SELECT password_hash FROM users WHERE email = 'janed@mail.ru'")).scalar()
+    assert check_password_hash(password_hash, '123456789')
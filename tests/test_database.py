@@ -0,0 +1,115 @@
+import threading
+import pytest
+from sqlalchemy import text
+from app import catalog
+from app.database import get_session, transaction
+from app.services import BookService
+
+THREADS = 10
+CALLS_PER_THREAD = 30
+
+
+@pytest.fixture
+def cart_setup(db):
+    """Пользователи с пустыми корзинами и книги с остатком, которого хватит на все добавления"""
+    with db() as connection:
+        users = [row[0] for row in connection.execute(text('SELECT id FROM users ORDER BY id LIMIT :n'),
+                                                      {'n': THREADS})]
+        books = [row[0] for row in connection.execute(text('SELECT id FROM books ORDER BY id LIMIT 5'))]
+        connection.execute(text('DELETE FROM cart_items'))
+        connection.execute(text('DELETE FROM reservations'))
+        connection.execute(text('UPDATE books SET quantity = 100000 WHERE id IN ({})'.format(
+            ', '.join(str(book_id) for book_id in books))))
+    assert len(users) == THREADS
+    return users, books
+
+
+def _cart_units(db):
+    with db() as connection:
+        return connection.execute(text('SELECT COALESCE(SUM(quantity), 0) FROM cart_items')).scalar()
+
+
+def _run_threads(target, users):
+    errors = []
+
+    def worker(user_id):
+        try:
+            target(user_id)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=worker, args=(user_id,)) for user_id in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def test_concurrent_update_cart_outside_request(cart_setup, db):
+    """Параллельные транзакции записи ждут блокировку по busy_timeout, а не падают с database is locked"""
+    users, books = cart_setup
+    failures = []
+
+    def add_books(user_id):
+        for call in range(CALLS_PER_THREAD):
+            try:
+                BookService.update_cart(user_id, books[call % len(books)])
+            except Exception as error:
+                failures.append(repr(error.__cause__ or error))
+
+    assert _run_threads(add_books, users) == []
+    assert failures == []
+    assert _cart_units(db) == THREADS * CALLS_PER_THREAD
+
+
+def test_concurrent_add_to_cart_requests(cart_setup, db, login):
+    """Запрос сначала читает (пользователь, страница), затем пишет: запись не должна падать при конкуренции"""
+    users, books = cart_setup
+
+    def add_books(user_id):
+        client = login(user_id)
+        for call in range(CALLS_PER_THREAD):
+            response = client.post(f'/books/{books[call % len(books)]}', data={'form_type': 'add_book'})
+            assert response.status_code == 302
+
+    assert _run_threads(add_books, users) == []
+    assert _cart_units(db) == THREADS * CALLS_PER_THREAD
+
+
+def _catalog_version(db):
+    with db() as connection:
+        return connection.execute(text('SELECT version FROM catalog_state WHERE id = 1')).scalar()
+
+
+def test_request_transaction_commits_on_exit(app, db):
+    """Транзакция записи в запросе фиксируется по выходе из внешнего transaction(), а не в конце запроса"""
+    before = _catalog_version(db)
+    with app.test_request_context():
+        with transaction() as db_session:
+            catalog.bump_version(db_session)
+            with transaction():
+                catalog.bump_version(db_session)
+        assert not get_session().in_transaction()
+        assert _catalog_version(db) == before + 2
+
+
+def test_request_transaction_rolls_back_on_error(app, db):
+    before = _catalog_version(db)
+    with app.test_request_context():
+        with pytest.raises(RuntimeError):
+            with transaction() as db_session:
+                catalog.bump_version(db_session)
+                raise RuntimeError('ошибка после записи')
+        assert _catalog_version(db) == before
+
+
+def test_snapshot_ignores_uncommitted_version(app, monkeypatch):
+    """Снимок каталога не строится по версии, которую запрос записал, но еще не зафиксировал"""
+    committed = catalog.get_snapshot().version
+    monkeypatch.setattr(catalog, '_checked_at', 0.0)
+    with app.test_request_context():
+        with transaction() as db_session:
+            catalog.bump_version(db_session)
+            assert catalog.get_snapshot().version == committed
+    assert catalog.get_snapshot().version == committed + 1
@@ -0,0 +1,44 @@
+import pytest
+from app.fragment_cache import LazyValue, fragment_cache
+from app.services import BookService
+
+
+@pytest.fixture
+def top_books_calls(monkeypatch):
+    """Счетчик вызовов запросов ТОПов главной страницы"""
+    calls = []
+    for name in ('get_top_books', 'get_top_books_by_genre'):
+        original = getattr(BookService, name)
+
+        def counted(*args, _original=original, _name=name, **kwargs):
+            calls.append(_name)
+            return _original(*args, **kwargs)
+
+        monkeypatch.setattr(BookService, name, staticmethod(counted))
+    return calls
+
+
+def test_home_page_queries_tops_only_on_cache_miss(client, top_books_calls):
+    fragment_cache.clear()
+    first = client.get('/')
+    assert first.status_code == 200
+    assert sorted(top_books_calls) == ['get_top_books', 'get_top_books_by_genre']
+
+    second = client.get('/')
+    assert second.status_code == 200
+    assert second.data == first.data
+    assert len(top_books_calls) == 2
+
+
+def test_lazy_value_loads_once():
+    calls = []
+
+    def load():
+        calls.append(1)
+        return {'Проза': [1, 2]}
+
+    value = LazyValue(load)
+    assert calls == []
+    assert list(value.items()) == [('Проза', [1, 2])]
+    assert value['Проза'] == [1, 2] and len(value) == 1 and value
+    assert calls == [1]
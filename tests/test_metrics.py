@@ -0,0 +1,76 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+import pytest
+from app.metrics import Counter, MetricsRegistry
+
+ROOT = Path(__file__).resolve().parent.parent
+WORKERS = 2
+REQUESTS_PER_WORKER = 10
+# воркер обслуживает запросы подряд и затем простаивает, не завершаясь
+WORKER = '''
+import sys, time
+from app import create_app
+client = create_app().test_client()
+for _ in range({requests}):
+    assert client.get('/catalog').status_code == 200
+print('done', flush=True)
+time.sleep(60)
+'''
+
+
+def _catalog_requests(metrics_dir):
+    registry = MetricsRegistry(metrics_dir)
+    registry.register(Counter('bookstore_requests_total', 'Обработанные запросы', ('endpoint', 'method', 'status')))
+    series = registry.collect().get('bookstore_requests_total', {})
+    return sum(value for key, value in series.items() if json.loads(key)[0] == 'books.catalog')
+
+
+def test_idle_workers_flush_their_last_requests(app, tmp_path):
+    """Метрики всех воркеров суммируются в /metrics, даже если после запросов воркеры простаивают"""
+    env = {**os.environ, 'METRICS_ENABLED': 'true', 'METRICS_DIR': str(tmp_path), 'METRICS_FLUSH_INTERVAL': '0.2'}
+    workers = [subprocess.Popen([sys.executable, '-c', WORKER.format(requests=REQUESTS_PER_WORKER)],
+                                cwd=ROOT, env=env, stdout=subprocess.PIPE, text=True)
+               for _ in range(WORKERS)]
+    try:
+        for worker in workers:
+            assert worker.stdout.readline().strip() == 'done'
+        expected = WORKERS * REQUESTS_PER_WORKER
+        deadline = time.monotonic() + 5
+        while _catalog_requests(tmp_path) < expected and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assert _catalog_requests(tmp_path) == expected
+        assert all(worker.poll() is None for worker in workers)
+    finally:
+        for worker in workers:
+            worker.kill()
+            worker.wait()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='нужен os.fork')
+def test_forked_child_gets_own_lock_values_and_file(tmp_path):
+    """Fork, пока блокировку держит другой поток, не блокирует дочерний процесс и не смешивает значения"""
+    registry = MetricsRegistry(tmp_path)
+    counter = registry.register(Counter('events_total', 'События'))
+    registry.record(lambda: counter.inc(5))
+    registry.flush(force=True)
+
+    with registry._lock:
+        pid = os.fork()
+        if pid == 0:
+            signal.alarm(5)
+            try:
+                registry.record(lambda: counter.inc())
+                registry.flush(force=True)
+            finally:
+                os._exit(0)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+    files = sorted(tmp_path.glob('metrics-*.json'))
+    assert len(files) == 2
+    assert sorted(json.loads(path.read_text(encoding='utf-8'))['events_total']['[]'] for path in files) == [1, 5]
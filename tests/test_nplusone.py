@@ -0,0 +1,47 @@
+import pytest
+from app import create_app
+from app.config import get_settings
+from app.database import session_scope
+from app.models import Book
+
+
+@pytest.fixture
+def detecting_client(app, monkeypatch):
+    """Клиент приложения с обнаружением N+1 на каждый запрос (NPLUSONE_DETECT=true)"""
+    monkeypatch.setattr(get_settings(), 'NPLUSONE_DETECT', True)
+    application = create_app()
+    application.config['TESTING'] = True
+    return application.test_client()
+
+
+def test_query_budget_counts_request_queries(client, query_budget):
+    with query_budget(50) as tracker:
+        assert client.get('/books/1').status_code == 200
+    assert tracker.query_count > 0
+
+
+def test_query_budget_with_request_detection(detecting_client, query_budget):
+    """Трекер запроса при NPLUSONE_DETECT не заслоняет внешний трекер query_budget"""
+    with query_budget(50) as tracker:
+        assert detecting_client.get('/books/1').status_code == 200
+    assert tracker.query_count > 0
+
+    with pytest.raises(pytest.fail.Exception, match='при бюджете 0'):
+        with query_budget(0):
+            detecting_client.get('/books/1')
+
+
+def test_query_budget_reports_nplusone(query_budget):
+    with pytest.raises(pytest.fail.Exception, match='N\\+1'):
+        with query_budget(100, threshold=3):
+            with session_scope() as db_session:
+                for book in db_session.query(Book).order_by(Book.id).limit(5):
+                    assert book.reviews is not None
+
+
+def test_query_budget_allows_declared_nplusone(query_budget):
+    with query_budget(100, allow_nplusone=True, threshold=3) as tracker:
+        with session_scope() as db_session:
+            for book in db_session.query(Book).order_by(Book.id).limit(5):
+                assert book.reviews is not None
+    assert tracker.suspects() == [('Book.reviews', 'вне сервисов', 5)]
@@ -0,0 +1,168 @@
+from decimal import Decimal
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from app.exceptions import OutOfStockError
+from app.models import Order
+from app.services import OrderService
+
+
+@pytest.fixture
+def shop(db):
+    """Два покупателя с пустыми корзинами и две книги с известными остатками"""
+    with db() as connection:
+        buyer, other = [row[0] for row in connection.execute(text('SELECT id FROM users ORDER BY id LIMIT 2'))]
+        books = [row[0] for row in connection.execute(text('SELECT id FROM books ORDER BY id LIMIT 2'))]
+        connection.execute(text('DELETE FROM cart_items'))
+        connection.execute(text('DELETE FROM reservations'))
+        connection.execute(text('UPDATE books SET quantity = 10 WHERE id IN (:first, :second)'),
+                           {'first': books[0], 'second': books[1]})
+    return buyer, other, books
+
+
+def _put_in_cart(db, user_id, book_id, quantity):
+    with db() as connection:
+        connection.execute(text('INSERT INTO cart_items (user_id, book_id, quantity) '
+                                'VALUES (:user_id, :book_id, :quantity)'),
+                           {'user_id': user_id, 'book_id': book_id, 'quantity': quantity})
+
+
+def _scalar(db, query, **params):
+    with db() as connection:
+        return connection.execute(text(query), params).scalar()
+
+
+def _stock(db, book_id):
+    return _scalar(db, 'SELECT quantity FROM books WHERE id = :book_id', book_id=book_id)
+
+
+def test_place_order_writes_items_totals_and_stock(db, shop):
+    buyer, _, (first, second) = shop
+    _put_in_cart(db, buyer, first, 2)
+    _put_in_cart(db, buyer, second, 1)
+    prices = {book_id: Decimal(str(_scalar(db, 'SELECT price FROM books WHERE id = :book_id', book_id=book_id)))
+              for book_id in (first, second)}
+
+    order_id = OrderService.place_order(buyer, 'Москва', 'pickup')
+
+    with db() as connection:
+        items = connection.execute(text('SELECT book_id, quantity, price FROM order_items WHERE order_id = :order_id '
+                                        'ORDER BY book_id'), {'order_id': order_id}).all()
+        order = connection.execute(text('SELECT item_count, total_amount FROM orders WHERE id = :order_id'),
+                                   {'order_id': order_id}).one()
+    assert [(item.book_id, item.quantity) for item in items] == [(first, 2), (second, 1)]
+    assert [Decimal(str(item.price)) for item in items] == [prices[first], prices[second]]
+    assert order.item_count == 3
+    assert Decimal(str(order.total_amount)) == prices[first] * 2 + prices[second]
+    assert (_stock(db, first), _stock(db, second)) == (8, 9)
+    assert _scalar(db, 'SELECT COUNT(*) FROM cart_items WHERE user_id = :user_id', user_id=buyer) == 0
+
+
+def test_place_order_clamps_line_to_available_stock(db, shop):
+    buyer, _, (first, _) = shop
+    _put_in_cart(db, buyer, first, 12)
+    order_id = OrderService.place_order(buyer, 'Москва', 'pickup')
+    assert _scalar(db, 'SELECT quantity FROM order_items WHERE order_id = :order_id', order_id=order_id) == 10
+    assert _scalar(db, 'SELECT item_count FROM orders WHERE id = :order_id', order_id=order_id) == 10
+    assert _stock(db, first) == 0
+
+
+def test_place_order_rolls_back_when_stock_runs_out(db, shop):
+    """Остаток, закончившийся до списания, отменяет весь заказ вместе с позициями"""
+    buyer, _, (first, second) = shop
+    _put_in_cart(db, buyer, first, 2)
+    _put_in_cart(db, buyer, second, 1)
+    orders_before = _scalar(db, 'SELECT COUNT(*) FROM orders')
+    items_before = _scalar(db, 'SELECT COUNT(*) FROM order_items')
+
+    def sell_out(session, flush_context):
+        if any(isinstance(instance, Order) for instance in session.new):
+            session.connection().execute(text('UPDATE books SET quantity = 1 WHERE id = :book_id'), {'book_id': first})
+
+    event.listen(Session, 'after_flush', sell_out)
+    try:
+        with pytest.raises(OutOfStockError):
+            OrderService.place_order(buyer, 'Москва', 'pickup')
+    finally:
+        event.remove(Session, 'after_flush', sell_out)
+
+    assert _scalar(db, 'SELECT COUNT(*) FROM orders') == orders_before
+    assert _scalar(db, 'SELECT COUNT(*) FROM order_items') == items_before
+    assert (_stock(db, first), _stock(db, second)) == (10, 10)
+    assert _scalar(db, 'SELECT SUM(quantity) FROM cart_items WHERE user_id = :user_id', user_id=buyer) == 3
+
+
+def test_place_order_without_available_items(db, shop):
+    buyer, _, (first, _) = shop
+    _put_in_cart(db, buyer, first, 1)
+    with db() as connection:
+        connection.execute(text('UPDATE books SET quantity = 0 WHERE id = :book_id'), {'book_id': first})
+    with pytest.raises(OutOfStockError):
+        OrderService.place_order(buyer, 'Москва', 'pickup')
+
+
+def test_place_order_releases_reservations_and_clamps_other_carts(db, shop):
+    buyer, other, (first, _) = shop
+    with db() as connection:
+        connection.execute(text('UPDATE books SET quantity = 3 WHERE id = :book_id'), {'book_id': first})
+        connection.execute(text("INSERT INTO reservations (user_id, book_id, quantity, expires_at) "
+                                "VALUES (:user_id, :book_id, 2, '2100-01-01 00:00:00')"),
+                           {'user_id': buyer, 'book_id': first})
+    _put_in_cart(db, buyer, first, 2)
+    # резерв другого покупателя истек, его корзина больше остатка после заказа
+    _put_in_cart(db, other, first, 3)
+
+    OrderService.place_order(buyer, 'Москва', 'pickup')
+
+    assert _stock(db, first) == 1
+    assert _scalar(db, 'SELECT COUNT(*) FROM reservations WHERE user_id = :user_id', user_id=buyer) == 0
+    assert _scalar(db, 'SELECT quantity FROM cart_items WHERE user_id = :user_id', user_id=other) == 1
+
+
+def test_rebuild_order_totals_matches_items(db):
+    with db() as connection:
+        connection.execute(text('UPDATE orders SET item_count = 0, total_amount = 0'))
+    OrderService.rebuild_order_totals()
+    with db() as connection:
+        mismatched = connection.execute(text(
+            'SELECT COUNT(*) FROM orders WHERE item_count != '
+            '(SELECT COALESCE(SUM(quantity), 0) FROM order_items WHERE order_id = orders.id) '
+            'OR ROUND(total_amount, 2) != '
+            '(SELECT ROUND(COALESCE(SUM(quantity * price), 0), 2) FROM order_items WHERE order_id = orders.id)'
+        )).scalar()
+        orders_count = connection.execute(text('SELECT COUNT(*) FROM orders WHERE item_count > 0')).scalar()
+    assert mismatched == 0
+    assert orders_count > 0
+
+
+def test_payment_page_shows_stored_total(db, login):
+    with db() as connection:
+        order_id, user_id = connection.execute(text('SELECT id, user_id FROM orders ORDER BY id LIMIT 1')).one()
+        connection.execute(text('UPDATE orders SET total_amount = 1234.5 WHERE id = :order_id'),
+                           {'order_id': order_id})
+    response = login(user_id).get(f'/orders/order_payment/{user_id}/{order_id}/card_details')
+    assert response.status_code == 200
+    assert '1234.50 руб.' in response.get_data(as_text=True)
+
+
+def test_order_history_pages_through_equal_timestamps(db, shop):
+    """Заказы с одинаковым created_at на границе страниц не теряются и не повторяются"""
+    buyer = shop[0]
+    with db() as connection:
+        for _ in range(5):
+            connection.execute(text("INSERT INTO orders (user_id, created_at, updated_at, status, delivery_method, "
+                                    "address) VALUES (:user_id, '2100-01-01 10:00:00.000000', "
+                                    "'2100-01-01 10:00:00.000000', 'NEW', 'PICKUP', 'Москва')"),
+                               {'user_id': buyer})
+        expected = connection.execute(text('SELECT id FROM orders WHERE user_id = :user_id '
+                                           'ORDER BY created_at DESC, id DESC'), {'user_id': buyer}).scalars().all()
+
+    seen, cursor = [], None
+    while True:
+        page = OrderService.get_order_history(buyer, cursor=cursor, limit=2)
+        assert len(page['orders']) <= 2
+        seen.extend(order['id'] for order in page['orders'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert seen == expected
@@ -0,0 +1,91 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from app.database import migrate_db, remove_duplicate_reviews
+from app.exceptions import BookNotFoundError, DuplicateReviewsError, ReviewExistsError
+from app.models import Base
+from app.services import BookService
+
+AGGREGATES = ('reviews_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5', 'rating')
+
+
+def _aggregates(db, book_id=None):
+    query = f'SELECT id, {", ".join(AGGREGATES)} FROM books'
+    with db() as connection:
+        rows = connection.execute(text(query + (' WHERE id = :book_id' if book_id else '') + ' ORDER BY id'),
+                                  {'book_id': book_id}).all()
+    aggregates = {row[0]: dict(zip(AGGREGATES, row[1:])) for row in rows}
+    return aggregates[book_id] if book_id else aggregates
+
+
+@pytest.fixture
+def users(db):
+    with db() as connection:
+        return [row[0] for row in connection.execute(text('SELECT id FROM users ORDER BY id LIMIT 3'))]
+
+
+@pytest.fixture
+def book_id(db):
+    """Книга без отзывов"""
+    with db() as connection:
+        book_id = connection.execute(text('SELECT id FROM books ORDER BY id DESC LIMIT 1')).scalar()
+        connection.execute(text('DELETE FROM reviews WHERE book_id = :book_id'), {'book_id': book_id})
+    return book_id
+
+
+def test_review_triggers_maintain_aggregates(db, users, book_id):
+    for user_id, rating in zip(users, (5, 4, 4)):
+        BookService.add_review('Отзыв', user_id, book_id, rating)
+    assert _aggregates(db, book_id) == {'reviews_count': 3, 'rating_sum': 13, 'rating_1': 0, 'rating_2': 0,
+                                        'rating_3': 0, 'rating_4': 2, 'rating_5': 1, 'rating': 4.3}
+
+    with db() as connection:
+        connection.execute(text('DELETE FROM reviews WHERE book_id = :book_id AND rating = 5'), {'book_id': book_id})
+    assert _aggregates(db, book_id) == {'reviews_count': 2, 'rating_sum': 8, 'rating_1': 0, 'rating_2': 0,
+                                        'rating_3': 0, 'rating_4': 2, 'rating_5': 0, 'rating': 4.0}
+
+
+def test_rebuild_rating_stats_matches_triggers(db, users, book_id):
+    BookService.add_review('Отзыв', users[0], book_id, 2)
+    maintained = _aggregates(db)
+    with db() as connection:
+        connection.execute(text('UPDATE books SET reviews_count = 0, rating_sum = 0, rating_2 = 0 '
+                                'WHERE id = :book_id'), {'book_id': book_id})
+    BookService.rebuild_rating_stats()
+    assert _aggregates(db) == maintained
+
+
+def test_add_review_rejects_repeat_and_missing_book(db, users, book_id):
+    BookService.add_review('Первый отзыв', users[0], book_id, 5)
+    with pytest.raises(ReviewExistsError):
+        BookService.add_review('Второй отзыв', users[0], book_id, 1)
+    assert _aggregates(db, book_id)['reviews_count'] == 1
+    with pytest.raises(BookNotFoundError):
+        BookService.add_review('Отзыв', users[0], 10 ** 6, 5)
+
+
+def test_migration_keeps_duplicate_reviews():
+    """Миграция не удаляет повторные отзывы сама, а называет их; уникальный индекс появляется после очистки"""
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql('DROP INDEX ux_reviews_user_book')
+        connection.exec_driver_sql("INSERT INTO users (id, name, surname, email, phone, password_hash) "
+                                   "VALUES (1, 'Иван', 'Иванов', 'ivan@example.com', '+79990000001', 'hash')")
+        connection.exec_driver_sql("INSERT INTO books (id, title, author, price, genre, description, pages, rating, "
+                                   "year, quantity) VALUES (1, 'Книга', 'Автор', 100, 'Проза', 'Описание', 100, "
+                                   "4.5, 2020, 10)")
+        connection.exec_driver_sql("INSERT INTO reviews (review, user_id, book_id, rating) "
+                                   "VALUES ('Первый', 1, 1, 5), ('Повтор', 1, 1, 1), ('Удаленный', NULL, 1, 3)")
+
+    with pytest.raises(DuplicateReviewsError, match=r'\(1, 1\)'):
+        with engine.begin() as connection:
+            migrate_db(connection)
+    with engine.begin() as connection:
+        assert connection.exec_driver_sql('SELECT COUNT(*) FROM reviews').scalar() == 3
+        assert remove_duplicate_reviews(connection) == 1
+        migrate_db(connection)
+        assert 'ux_reviews_user_book' in {index['name'] for index in inspect(connection).get_indexes('reviews')}
+        assert connection.exec_driver_sql('SELECT review FROM reviews ORDER BY id').scalars().all() == [
+            'Первый', 'Удаленный'
+        ]
+    engine.dispose()
@@ -0,0 +1,49 @@
+import pytest
+from sqlalchemy import text
+from app.services import BookService, CartService
+
+STOCK = 3
+
+
+@pytest.fixture
+def book_with_reservation(db):
+    """Книга с остатком STOCK, два экземпляра которой лежат в корзине первого пользователя"""
+    with db() as connection:
+        buyer, other = [row[0] for row in connection.execute(text('SELECT id FROM users ORDER BY id LIMIT 2'))]
+        book_id = connection.execute(text('SELECT id FROM books ORDER BY id DESC LIMIT 1')).scalar()
+        connection.execute(text('DELETE FROM cart_items'))
+        connection.execute(text('DELETE FROM reservations'))
+        connection.execute(text('UPDATE books SET quantity = :stock WHERE id = :book_id'),
+                           {'stock': STOCK, 'book_id': book_id})
+    BookService.update_cart(buyer, book_id)
+    BookService.update_cart(buyer, book_id)
+    return book_id, buyer, other
+
+
+def _stock_line(response):
+    html = response.get_data(as_text=True)
+    return html[html.index('В наличии:'):].split('экз.')[0]
+
+
+def test_book_page_subtracts_reservations_of_others(client, login, book_with_reservation):
+    book_id, buyer, other = book_with_reservation
+    assert _stock_line(client.get(f'/books/{book_id}')).endswith(f' {STOCK - 2} ')
+    assert _stock_line(login(other).get(f'/books/{book_id}')).endswith(f' {STOCK - 2} ')
+    # собственный резерв покупателю доступен
+    assert _stock_line(login(buyer).get(f'/books/{book_id}')).endswith(f' {STOCK} ')
+
+    BookService.update_cart(other, book_id)
+    item = CartService.get_cart_view(other)['items'][0]
+    page = BookService.get_book_page(book_id, other)
+    assert page['book_quantity'] == item['store_quantity'] == STOCK - 2
+
+
+def test_book_page_etag_changes_with_reservations(client, book_with_reservation):
+    book_id, buyer, _ = book_with_reservation
+    first = client.get(f'/books/{book_id}')
+    assert client.get(f'/books/{book_id}', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    CartService.clear_users_cart(buyer)
+    second = client.get(f'/books/{book_id}', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert _stock_line(second).endswith(f' {STOCK} ')
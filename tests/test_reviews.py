@@ -0,0 +1,50 @@
+import pytest
+from sqlalchemy import text
+from app.services import BookService
+
+RATINGS = (5, 3, 5, 3, 5, 1, 3)
+EXPECTED_ORDER = {
+    'newest': 'ORDER BY id DESC',
+    'rating': 'ORDER BY rating DESC, id DESC'
+}
+
+
+@pytest.fixture
+def reviewed_book(db):
+    """Книга с отзывами, у которых повторяются оценки"""
+    with db() as connection:
+        book_id = connection.execute(text('SELECT id FROM books ORDER BY id DESC LIMIT 1')).scalar()
+        users = [row[0] for row in connection.execute(text('SELECT id FROM users ORDER BY id LIMIT :n'),
+                                                      {'n': len(RATINGS)})]
+        connection.execute(text('DELETE FROM reviews WHERE book_id = :book_id'), {'book_id': book_id})
+        for user_id, rating in zip(users, RATINGS):
+            connection.execute(text("INSERT INTO reviews (review, user_id, book_id, rating) "
+                                    "VALUES ('Отзыв', :user_id, :book_id, :rating)"),
+                               {'user_id': user_id, 'book_id': book_id, 'rating': rating})
+    return book_id
+
+
+@pytest.mark.parametrize('sort', ['newest', 'rating'])
+def test_review_pages_follow_cursor(db, reviewed_book, sort):
+    """Страницы отзывов по курсору проходят все отзывы по одному разу, в том числе при равных оценках"""
+    with db() as connection:
+        expected = connection.execute(text(f'SELECT id FROM reviews WHERE book_id = :book_id {EXPECTED_ORDER[sort]}'),
+                                      {'book_id': reviewed_book}).scalars().all()
+
+    seen, cursor = [], None
+    while True:
+        page = BookService.get_book_page(reviewed_book, reviews_sort=sort, reviews_cursor=cursor, limit=2)['reviews']
+        assert len(page['reviews']) <= 2
+        seen.extend(review['id'] for review in page['reviews'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert seen == expected
+    assert page['count'] == len(RATINGS)
+    assert page['histogram'] == {5: 3, 4: 0, 3: 3, 2: 0, 1: 1}
+
+
+def test_review_cursor_of_other_sort_is_rejected(reviewed_book):
+    cursor = BookService.get_book_page(reviewed_book, reviews_sort='newest', limit=2)['reviews']['next_cursor']
+    with pytest.raises(ValueError):
+        BookService.get_book_page(reviewed_book, reviews_sort='rating', reviews_cursor=cursor)
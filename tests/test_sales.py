@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from sqlalchemy import text
+from app.database import session_scope
+from app.models import Book, BookSales, Order, OrderItem
+from app.services import BookService
+
+MOSCOW = timezone(timedelta(hours=3))
+# воскресенье и следующий за ним понедельник по местному времени; в UTC оба момента приходятся на воскресенье
+SUNDAY_NIGHT = datetime(2100, 1, 3, 23, 30, tzinfo=MOSCOW)
+MONDAY_NIGHT = datetime(2100, 1, 4, 0, 30, tzinfo=MOSCOW)
+
+
+def _sales(db):
+    with db() as connection:
+        rows = connection.execute(text('SELECT book_id, period, genre, units_sold, revenue FROM book_sales '
+                                       'ORDER BY book_id, period')).all()
+    return [(row.book_id, row.period, row.genre, row.units_sold, Decimal(str(row.revenue)).quantize(Decimal('0.01')))
+            for row in rows]
+
+
+def _sell(book, quantity, sold_at):
+    """Заказ с одной позицией и его продажи в агрегатах, как при оформлении"""
+    with session_scope() as db_session:
+        order = Order(user_id=1, created_at=sold_at, updated_at=sold_at, delivery_method='pickup', address='Москва')
+        db_session.add(order)
+        db_session.flush()
+        db_session.add(OrderItem(order_id=order.id, book_id=book.id, quantity=quantity, price=book.price))
+        BookService.record_sales(db_session, [(book.id, book.genre, quantity, book.price)], sold_at)
+
+
+def test_recorded_sales_match_rebuild_across_week_boundary(app, db):
+    BookService.rebuild_sales_stats()
+    with session_scope() as db_session:
+        book = db_session.query(Book).order_by(Book.id).first()
+        db_session.expunge(book)
+
+    _sell(book, 2, SUNDAY_NIGHT)
+    _sell(book, 3, MONDAY_NIGHT)
+    recorded = _sales(db)
+    weeks = {row[1]: row[3] for row in recorded if row[0] == book.id and row[1] != BookSales.ALL_TIME}
+    assert weeks['2099-12-28'] == 2
+    assert weeks['2100-01-04'] == 3
+
+    BookService.rebuild_sales_stats()
+    assert _sales(db) == recorded
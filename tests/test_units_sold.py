@@ -0,0 +1,50 @@
+import pytest
+from sqlalchemy import text
+from app.services import BookService
+
+
+@pytest.fixture
+def order_and_book(db):
+    with db() as connection:
+        order_id = connection.execute(text('SELECT id FROM orders ORDER BY id LIMIT 1')).scalar()
+        book_id = connection.execute(text('SELECT id FROM books ORDER BY id LIMIT 1')).scalar()
+    return order_id, book_id
+
+
+def _units_sold(db, book_id):
+    with db() as connection:
+        return connection.execute(text('SELECT units_sold FROM books WHERE id = :book_id'),
+                                  {'book_id': book_id}).scalar()
+
+
+def test_order_item_triggers_maintain_units_sold(db, order_and_book):
+    order_id, book_id = order_and_book
+    before = _units_sold(db, book_id)
+    with db() as connection:
+        item_id = connection.execute(text('INSERT INTO order_items (order_id, book_id, quantity, price) '
+                                          'VALUES (:order_id, :book_id, 4, 100)'),
+                                     {'order_id': order_id, 'book_id': book_id}).lastrowid
+    assert _units_sold(db, book_id) == before + 4
+
+    with db() as connection:
+        connection.execute(text('UPDATE order_items SET quantity = 1 WHERE id = :item_id'), {'item_id': item_id})
+    assert _units_sold(db, book_id) == before + 1
+
+    with db() as connection:
+        connection.execute(text('DELETE FROM order_items WHERE id = :item_id'), {'item_id': item_id})
+    assert _units_sold(db, book_id) == before
+
+
+def test_verify_units_sold_reports_and_repairs_drift(db, order_and_book):
+    _, book_id = order_and_book
+    assert BookService.verify_units_sold() == []
+    actual = _units_sold(db, book_id)
+    with db() as connection:
+        connection.execute(text('UPDATE books SET units_sold = units_sold + 7 WHERE id = :book_id'),
+                           {'book_id': book_id})
+
+    assert BookService.verify_units_sold() == [(book_id, actual + 7, actual)]
+    assert _units_sold(db, book_id) == actual + 7
+    assert BookService.verify_units_sold(fix=True) == [(book_id, actual + 7, actual)]
+    assert _units_sold(db, book_id) == actual
+    assert BookService.verify_units_sold() == []
@@ -0,0 +1,11 @@
+"""WSGI-точка входа для продакшн-сервера.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+БД готовит мастер-процесс gunicorn (см. gunicorn.conf.py); при запуске под другим WSGI-сервером
+схему и начальные данные нужно подготовить заранее: `flask --app app init-db`.
+"""
+from app import create_app
+
+app = create_app()
+application = app